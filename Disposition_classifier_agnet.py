@@ -1,16 +1,24 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 from fastapi import APIRouter
-from preprocess_csv import get_disposition_data, get_disposition_data_grievance
-from grivance_agent import get_grievance
-from connection_status import detect_connection_status
-from summary_agent import get_summary
-from typing import List, Dict, Any, Optional
+from preprocess_csv import get_tables, TableSnapshot
+from grivance_agent import aget_grievance, speculate_grievance, record_missed_speculation, GrievanceSpeculation
+from connection_status import adetect_connection_status, status_flight, CONNECTED, NOT_CONNECTED
+from summary_agent import aget_summary, summary_cache, summary_flight
+from single_pass_agent import aget_single_pass
+from metrics import stage_timer, request_timings
+from result_cache import ResultCache, transcript_key, CACHE_ENABLED, CACHE_USE, CACHE_BYPASS
+from result_store import result_store
+from single_flight import SingleFlight
+from model_cascade import ModelCascade, CASCADE_SIGNATURE
+from preclassifier import preclassify, Preclassification
+from typing import List, Dict, Any, Optional, Literal
 from pydantic import BaseModel
+from pydantic.json_schema import SkipJsonSchema
 import loguru
-from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent
 from langchain.agents.middleware.types import AgentMiddleware, ModelRequest, ModelResponse, ModelCallResult
 
@@ -24,23 +32,30 @@ class DispositionResult(BaseModel):
     explanation: str
     summary: Optional[str] = None
     key_points: List[str]
-
-# Disposition classifier model is a model that classifies the disposition of the transcript
-model = ChatOpenAI(model=os.getenv("OPENAI_MODEL"), temperature=0.5)
-
-# Disposition classifier agent is a agent that classifies the disposition of the transcript
-agent = create_agent(
-    model=model,
-    tools=[],
-    response_format=DispositionResult
-)
-
-# Disposition data is a list of dispositions
-disposition_data_formated, disposition_data = get_disposition_data()
-
-
-# Disposition classifier system prompt is a prompt that classifies the disposition of the transcript
-system_prompt = f"""
+    # Model that answered each cascaded stage, e.g. {"classify": "gpt-4o-mini"}; left out of the schema the model fills
+    model_tiers: SkipJsonSchema[Optional[Dict[str, str]]] = None
+
+# Disposition classifier cascade classifies the disposition of the transcript, escalating to a larger model tier
+# when the answer's confidence is below its code's threshold or the code is not in the filtered table
+classifier = ModelCascade("classify", DispositionResult, temperature=0.5)
+
+# Disposition modes: the multi-stage pipeline (more accurate) or one combined model call (lower latency/cost)
+MULTI_STAGE = "multi_stage"
+SINGLE_PASS = "single_pass"
+# Mode recorded for results answered by the nearest-neighbour pre-classifier (see preclassifier.py)
+PRECLASSIFIER = "preclassifier"
+DISPOSITION_MODE = os.getenv("DISPOSITION_MODE", MULTI_STAGE)
+
+# Disposition cache stores final results by normalized transcript, model and table version
+disposition_cache = ResultCache("disposition")
+
+# Disposition flight lets concurrent requests for the same transcript, model and table version share one pipeline run
+disposition_flight = SingleFlight("disposition")
+
+# Disposition classifier system prompt is a prompt that classifies the disposition of the transcript,
+# built once per table version
+def build_system_prompt(tables: TableSnapshot) -> str:
+    return f"""
  You are a Senior Call Center Disposition Classifier for Loan Collections.
 
 You MUST classify the call using ONLY the provided disposition table.
@@ -56,8 +71,11 @@ This is a RAW CALL TRANSCRIPT between a loan collections agent (lender) and a cu
 
 
 CONNECTION STATUS GROUPS:
-CONNECTED DISPOSITIONS: {disposition_data_formated.split('Not Connected')[0]}
-NOT CONNECTED DISPOSITIONS: {disposition_data_formated.split('Not Connected')[1]}
+CONNECTED DISPOSITIONS:
+{tables.status_tables[CONNECTED]}
+
+NOT CONNECTED DISPOSITIONS:
+{tables.status_tables[NOT_CONNECTED]}
 
 
 ## CLASSIFICATION RULES (MANDATORY)
@@ -124,8 +142,163 @@ iii. key points: First, clearly list the main key points you have understood fro
 """
 
 # Disposition classifier agent is a agent that classifies the disposition of the transcript
+# cache=use reads and writes the result cache, cache=bypass skips it, cache=refresh recomputes and overwrites the entry
+# mode=single_pass answers with one combined model call, mode=multi_stage runs the full pipeline (default: DISPOSITION_MODE)
+# preclassifier=false always runs the model pipeline, without trying the nearest-neighbour pre-classifier first
 @router.post("/disposition")
-async def get_disposition(transcript: List[Dict[str, Any]]) -> DispositionResult:
+async def get_disposition(
+    transcript: List[Dict[str, Any]],
+    cache: Literal["use", "bypass", "refresh"] = CACHE_USE,
+    mode: Optional[Literal["multi_stage", "single_pass"]] = None,
+    preclassifier: bool = True,
+) -> DispositionResult:
+    mode = mode or DISPOSITION_MODE
+    # One table snapshot per request: a table reload mid-request does not mix versions
+    tables = get_tables()
+    key = transcript_key(transcript, "disposition", mode, os.getenv("OPENAI_MODEL"), tables.version, CASCADE_SIGNATURE)
+    use_cache = CACHE_ENABLED and cache != CACHE_BYPASS
+    if use_cache and cache == CACHE_USE:
+        cached = disposition_cache.get(key)
+        if cached is not None:
+            loguru.logger.info("Disposition cache hit")
+            return DispositionResult.model_validate_json(cached)
+
+    # Duplicates arriving while the first run is in flight wait for it; each gets its own copy of the result
+    result = await disposition_flight.run(
+        f"{key}:{cache}:{preclassifier}",
+        lambda: _run_and_store(transcript, mode, cache, tables, key if use_cache else None, preclassifier),
+    )
+    return result.model_copy(deep=True)
+
+# Run and store is a function that runs the pipeline once, then caches and stores the result.
+# Each run gets its own stage timings for the stored result (a batch request runs many pipelines); they are added
+# to the request's timings afterwards for the Server-Timing header.
+async def _run_and_store(transcript: List[Dict[str, Any]], mode: str, cache: str, tables: TableSnapshot,
+                         key: Optional[str], preclassifier: bool = True) -> DispositionResult:
+    request = request_timings.get()
+    timings = {}
+    token = request_timings.set(timings)
+    try:
+        return await _run_pipeline(transcript, mode, cache, tables, key, preclassifier)
+    finally:
+        request_timings.reset(token)
+        if request is not None:
+            for stage, ms in timings.items():
+                request[stage] = request.get(stage, 0.0) + ms
+
+# Run pipeline is a function that picks the pipeline for the call, then caches and stores its result.
+# Pre-classified results are not cached: the lookup is cheaper than the cache, and a cached answer would outlive
+# a rebuilt index or changed thresholds.
+async def _run_pipeline(transcript: List[Dict[str, Any]], mode: str, cache: str, tables: TableSnapshot,
+                        key: Optional[str], preclassifier: bool = True) -> DispositionResult:
+    details = {}
+    # Routine calls close to past calls are answered by the pre-classifier, without the summary and classifier LLM calls
+    preclassified = preclassify(transcript, tables) if preclassifier else None
+    if preclassified is not None:
+        result = preclassified_result(preclassified)
+        details["connection_status"] = preclassified.connection_status
+        mode = PRECLASSIFIER
+        key = None
+    elif mode == SINGLE_PASS:
+        result = await run_single_pass(transcript, tables, details)
+    else:
+        result = await run_disposition(transcript, cache_mode=cache, tables=tables, details=details)
+    if key is not None:
+        disposition_cache.set(key, result.model_dump_json())
+    await store_result(transcript, result, mode, tables, **details)
+    return result
+
+# Preclassified result is a function that turns a pre-classifier answer into a disposition result (there is no summary)
+def preclassified_result(preclassified: Preclassification) -> DispositionResult:
+    return finalize_disposition(DispositionResult(
+        Disposition_code=preclassified.code,
+        confidence=preclassified.confidence,
+        explanation=(
+            f"Pre-classified from similar past calls: {preclassified.votes} of the {preclassified.neighbours} nearest "
+            f"are {preclassified.code} (closest similarity {preclassified.similarity})."
+        ),
+        key_points=[],
+        model_tiers={"preclassifier": preclassified.index_version},
+    ))
+
+# Answering model is a function that names the model that chose the disposition code: the classifier cascade's tier,
+# the pre-classifier index version, or the configured model (single pass)
+def answering_model(result: DispositionResult) -> Optional[str]:
+    tiers = result.model_tiers or {}
+    if "classify" in tiers:
+        return tiers["classify"]
+    if "preclassifier" in tiers:
+        return f"preclassifier:{tiers['preclassifier']}"
+    return os.getenv("OPENAI_MODEL")
+
+# Store result is a function that queues a pipeline result for the result database (see result_store.py)
+async def store_result(transcript: List[Dict[str, Any]], result: DispositionResult, mode: str, tables: TableSnapshot,
+                       connection_status: Optional[str] = None, grievance_code: Optional[str] = None) -> None:
+    await result_store.enqueue({
+        "transcript": transcript,
+        "mode": mode,
+        "connection_status": connection_status,
+        "summary": result.summary,
+        "disposition_code": result.Disposition_code,
+        "grievance_code": grievance_code,
+        "confidence": result.confidence,
+        "explanation": result.explanation,
+        "key_points": result.key_points,
+        "stage_timings": {stage: round(ms, 1) for stage, ms in (request_timings.get() or {}).items()},
+        "model": answering_model(result),
+        "table_version": tables.version,
+    })
+
+# Disposition cache stats endpoint reports hit/miss/eviction counts for the disposition and summary caches
+@router.get("/disposition/cache/stats")
+async def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        "disposition": disposition_cache.get_stats(),
+        "summary": summary_cache.get_stats(),
+        "coalesced": {flight.name: flight.get_stats() for flight in (disposition_flight, summary_flight, status_flight)},
+    }
+
+# Disposition cache invalidation endpoint drops every cached disposition and summary
+@router.delete("/disposition/cache")
+async def invalidate_cache() -> Dict[str, str]:
+    disposition_cache.invalidate()
+    summary_cache.invalidate()
+    return {"status": "invalidated"}
+
+# Disposition tables endpoint reports the loaded table version (the key the result cache and logs use)
+@router.get("/disposition/tables")
+async def get_table_info() -> Dict[str, Any]:
+    tables = get_tables()
+    return {
+        "version": tables.version,
+        "loaded_at": tables.loaded_at,
+        "dispositions": {status: len(rows) for status, rows in tables.status_data.items()},
+        "grievance_codes": len(tables.grievance_data),
+    }
+
+# Run single pass is a function that classifies with one combined model call and returns the usual DispositionResult
+# details, when given, receives the connection status and grievance code for the result store
+async def run_single_pass(transcript: List[Dict[str, Any]], tables: Optional[TableSnapshot] = None,
+                          details: Optional[Dict[str, Any]] = None) -> DispositionResult:
+    response = await aget_single_pass(transcript, tables)
+    if details is not None:
+        details["connection_status"] = response.connection_status
+        if response.grievance_code and response.Disposition_code.startswith("GRIEVANCE("):
+            details["grievance_code"] = response.grievance_code.replace("_", " ")
+    return DispositionResult(
+        Disposition_code=response.Disposition_code,
+        confidence=response.confidence,
+        explanation=response.explanation,
+        summary=response.summary,
+        key_points=response.key_points,
+    )
+
+# Run disposition is a function that runs the connection -> summary -> classify -> grievance pipeline
+# details, when given, receives the connection status and grievance code for the result store
+async def run_disposition(transcript: List[Dict[str, Any]], cache_mode: str = CACHE_USE, tables: Optional[TableSnapshot] = None,
+                          details: Optional[Dict[str, Any]] = None) -> DispositionResult:
+    tables = tables or get_tables()
+    details = details if details is not None else {}
 
     # user_turns = len([msg for msg in transcript if msg['role'] == 'user'])
     
@@ -133,23 +306,40 @@ async def get_disposition(transcript: List[Dict[str, Any]]) -> DispositionResult
     # if user_turns <= 2:  
     #     return DispositionResult(Disposition_code="ANSWERED DISCONNECTED", confidence=-1.0, explanation="Less than 2 borrower turns", summary="", key_points=[])
 
-    connection_status = detect_connection_status(transcript)
-    summary = get_summary(transcript)
+    # Connection status and summary are independent, so run them concurrently
+    connection_status, summary = await asyncio.gather(
+        adetect_connection_status(transcript),
+        aget_summary(transcript, cache_mode=cache_mode),
+    )
     loguru.logger.info(f"Summary: {summary}")
-
-    filtered_disposition = [
-        d for d in disposition_data 
-        if d['connected_status'] == connection_status
-    ]
-    filtered_table = "\n".join([
-        f"{i+1}. CODE: {x['disposition_code']} | STATUS: {x['connected_status']} | LABEL: {x['disposition_label']} | DESC: {x['disposition_description']}"
-        for i, x in enumerate(filtered_disposition)
-    ])
-
-    result = agent.invoke({
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"""
+    details["connection_status"] = connection_status
+
+    speculation = speculate_for(summary, connection_status, tables)
+    result = await classify_or_cancel(summary, connection_status, tables, speculation)
+    if is_grievance(result, connection_status):
+        result = await resolve_grievance(result, summary, tables, speculation)
+        details["grievance_code"] = grievance_subcategory(result)
+        return result
+    if speculation is not None:
+        speculation.discard()
+    return finalize_disposition(result)
+
+# Filter table is a function that returns the disposition rows that match the connection status, formatted
+# (precomputed per table version)
+def filter_table(connection_status: str, tables: Optional[TableSnapshot] = None) -> str:
+    with stage_timer("table_filter"):
+        return (tables or get_tables()).status_tables.get(connection_status, "")
+
+# Classify summary is a function that runs the classifier agent on the summary and the status-filtered table
+async def classify_summary(summary: str, connection_status: str, tables: Optional[TableSnapshot] = None) -> DispositionResult:
+    tables = tables or get_tables()
+    filtered_table = filter_table(connection_status, tables)
+
+    with stage_timer("classify"):
+        result = await classifier.ainvoke({
+            "messages": [
+                {"role": "system", "content": tables.prompt("classifier", build_system_prompt)},
+                {"role": "user", "content": f"""
 Here is the summarized transcript. Classify it:
 
 SUMMARY:
@@ -158,19 +348,58 @@ SUMMARY:
 FILTERED TABLE:
 {filtered_table}
 """,}
-        ]
-    })
+            ]
+        }, allowed_codes=tables.status_codes.get(connection_status, frozenset()).__contains__)
     # loguru.logger.info(f"Disposition Result: {result}")
     result['structured_response'].summary = summary
-    loguru.logger.info(f"Disposition Result: {result['structured_response'].Disposition_code}")
+    result['structured_response'].model_tiers = {"classify": result['model_tier']}
+    loguru.logger.info(f"Disposition Result: {result['structured_response'].Disposition_code} (tables {tables.version})")
     loguru.logger.info(f"Connection Status: {connection_status}")
-
-    if result['structured_response'].Disposition_code == 'GRIEVANCE' and connection_status == "CONNECTED":
-        loguru.logger.info(f"Grievance detected")
-        result_grievance = get_grievance(summary)
-        result['structured_response'].Disposition_code = result_grievance['structured_response'].Disposition_code
-        return result['structured_response']
+    return result['structured_response']
+
+# Speculate for is a function that starts the grievance call early for complaint-like summaries of connected calls
+# (GRIEVANCE_SPECULATION); only connected calls are sub-classified
+def speculate_for(summary: str, connection_status: str, tables: TableSnapshot) -> Optional[GrievanceSpeculation]:
+    if connection_status != CONNECTED:
+        return None
+    return speculate_grievance(summary, tables)
+
+# Classify or cancel is a function that runs the classifier, cancelling the speculative grievance call if it fails
+async def classify_or_cancel(summary: str, connection_status: str, tables: TableSnapshot,
+                             speculation: Optional[GrievanceSpeculation]) -> DispositionResult:
+    try:
+        return await classify_summary(summary, connection_status, tables)
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+
+# Is grievance is a function that tells whether the classifier result needs grievance sub-classification
+def is_grievance(result: DispositionResult, connection_status: str) -> bool:
+    return result.Disposition_code == 'GRIEVANCE' and connection_status == CONNECTED
+
+# Resolve grievance is a function that replaces the GRIEVANCE code with the grievance sub-category code,
+# taking the speculative grievance call's answer when one was started
+async def resolve_grievance(result: DispositionResult, summary: str, tables: Optional[TableSnapshot] = None,
+                            speculation: Optional[GrievanceSpeculation] = None) -> DispositionResult:
+    loguru.logger.info(f"Grievance detected")
+    if speculation is not None:
+        result_grievance = await speculation.result()
     else:
-        result['structured_response'].Disposition_code = result['structured_response'].Disposition_code.replace("_", " ")
-        return result['structured_response']
-
+        record_missed_speculation()
+        result_grievance = await aget_grievance(summary, tables)
+    result.Disposition_code = result_grievance['structured_response'].Disposition_code
+    result.model_tiers = {**(result.model_tiers or {}), "grievance": result_grievance['model_tier']}
+    return result
+
+# Grievance subcategory is a function that reads the subcategory back out of a resolved GRIEVANCE(...) code
+def grievance_subcategory(result: DispositionResult) -> Optional[str]:
+    code = result.Disposition_code
+    if code.startswith("GRIEVANCE(") and code.endswith(")"):
+        return code[len("GRIEVANCE("):-1]
+    return None
+
+# Finalize disposition is a function that turns the table code into its display form
+def finalize_disposition(result: DispositionResult) -> DispositionResult:
+    result.Disposition_code = result.Disposition_code.replace("_", " ")
+    return result
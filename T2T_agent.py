@@ -1,14 +1,114 @@
-from typing import List, Dict, Any
+import os
+import re
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from metrics import stage_timer
+import loguru
 
-# T2T agent is a agent that converts the transcript into a text to text format
-def preprocess_transcript(transcript: List[Dict[str, Any]]):
-    transcript_string = ""
-    
+# Speaker labels used in the text form of the transcript
+SPEAKERS = {"user": "borrower", "assistant": "lender"}
+
+# Boilerplate is bot/IVR text that carries no information for the summary or the disposition. It is removed from
+# lender (bot/IVR) turns only: a borrower saying "please hold" or "please wait, I am checking my account" keeps every word.
+# Telecom status messages ("switched off", "busy") are NOT boilerplate: they decide the connection status.
+BOILERPLATE_PATTERNS = [
+    r"this call (?:is being|may be|will be) recorded[^.?!]*[.?!]?",
+    r"for (?:quality|training)(?: and (?:quality|training))? purposes?[.?!]?",
+    r"your call is important to us[.?!]?",
+    r"please (?:hold|stay on the line|wait)(?: the line)?[.?!]?",
+    r"press \d+ (?:for|to) [^.?!]*[.?!]?",
+    r"यह कॉल रिकॉर्ड की जा रही है[।.]?",
+    r"yeh call record ki ja rahi hai[.?!]?",
+]
+_boilerplate = re.compile("|".join(BOILERPLATE_PATTERNS), re.IGNORECASE)
+
+# Filler words dropped from turns (English and Hinglish hesitation sounds)
+FILLER_WORDS = {"um", "umm", "uh", "uhh", "hmm", "hmmm", "erm", "uh-huh", "mm", "mmm", "aaa", "acha-acha"}
+
+# Repeated filler pattern collapses "hello? hello? hello?" into "hello?". Only these words are collapsed: any other
+# repeat may be what the borrower said ("500 500 rupees", a phone number, "I had had enough")
+REPEATED_FILLERS = ["hello", "helo", "hallo", "hi", "haan", "haanji", "ha", "ji", "jee", "ok", "okay", "sir", "madam",
+                    "ma'am", "yes", "हाँ", "हां", "जी", "हेलो", "हैलो"]
+_repeated_word = re.compile(
+    r"(?<!\w)(" + "|".join(map(re.escape, REPEATED_FILLERS)) + r")([?!.,]?)(?:\s+\1\2)+(?!\w)", re.IGNORECASE
+)
+
+# Tokenizer is loaded once at startup (load_token_encoding); until then, and without the tiktoken encoding files
+# (offline), tokens are estimated from byte length
+_encoding = None
+_encoding_loaded = False
+
+# Load token encoding is a function that loads the tiktoken encoding, which may download it. It blocks, so the app
+# runs it in a thread from its lifespan and bulk workers run it at start-up; count_tokens never loads it itself,
+# so no request waits on the download.
+def load_token_encoding() -> None:
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return
+    _encoding_loaded = True
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(os.getenv("TOKEN_ENCODING", "o200k_base"))
+    except Exception as e:
+        loguru.logger.warning(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+
+# Count tokens is a function that counts prompt tokens with tiktoken, or estimates them when it is not loaded
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text.encode("utf-8")) // 4
+
+# Compact turn is a function that removes boilerplate, filler and repeated words from one turn of the given speaker
+def compact_turn(content: str, speaker: str) -> str:
+    if speaker == SPEAKERS["assistant"]:
+        content = _boilerplate.sub(" ", content)
+    words = [w for w in content.split() if w.lower().strip("?!.,") not in FILLER_WORDS]
+    content = _repeated_word.sub(r"\1\2", " ".join(words))
+    return content.strip(" ,")
+
+# Compact turns is a function that yields (speaker, text) pairs, skipping empty turns and collapsing
+# a turn that repeats the same speaker's previous turn
+def compact_turns(transcript: List[Dict[str, Any]]) -> Iterator[Tuple[str, str]]:
+    previous: Optional[Tuple[str, str]] = None
     for msg in transcript:
-        if msg['content'] is None:
+        speaker = SPEAKERS.get(msg.get('role'))
+        if speaker is None or not msg.get('content'):
+            continue
+        content = compact_turn(msg['content'], speaker)
+        if not content:
+            continue
+        turn = (speaker, content)
+        if previous is not None and previous[0] == speaker and previous[1].lower() == content.lower():
             continue
-        if msg['role'] == 'user':
-            transcript_string += "borrower said: " + msg['content'] + ", "
-        elif msg['role'] == 'assistant':
-            transcript_string += "lender said: " + msg['content'] + ", "
-    return transcript_string
\ No newline at end of file
+        previous = turn
+        yield turn
+
+# Format turn is a function that renders one turn the way the prompts expect it
+def format_turn(speaker: str, content: str) -> str:
+    return f"{speaker} said: {content}, "
+
+# Render transcript is a function that returns the compacted text form of the transcript, without recording a stage
+# (cache keys and the result store hash use it off the prompt path). Joined once at the end, so it is linear in the
+# transcript length.
+def render_transcript(transcript: List[Dict[str, Any]]) -> str:
+    return "".join(format_turn(speaker, content) for speaker, content in compact_turns(transcript))
+
+# T2T agent is a agent that converts the transcript into a text to text format
+def preprocess_transcript(transcript: List[Dict[str, Any]]):
+    with stage_timer("preprocess"):
+        return render_transcript(transcript)
+
+# Chunk transcript is a function that lazily yields transcript text chunks of at most max_tokens tokens each,
+# split on turn boundaries (a single turn longer than the budget becomes its own chunk)
+def chunk_transcript(transcript: List[Dict[str, Any]], max_tokens: int) -> Iterator[str]:
+    chunk: List[str] = []
+    chunk_tokens = 0
+    for speaker, content in compact_turns(transcript):
+        turn = format_turn(speaker, content)
+        turn_tokens = count_tokens(turn)
+        if chunk and chunk_tokens + turn_tokens > max_tokens:
+            yield "".join(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(turn)
+        chunk_tokens += turn_tokens
+    if chunk:
+        yield "".join(chunk)
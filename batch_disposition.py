@@ -0,0 +1,152 @@
+import os
+import json
+import asyncio
+import tempfile
+from dotenv import load_dotenv
+load_dotenv()
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional, AsyncIterator, Union
+from pydantic import BaseModel, ValidationError
+import loguru
+from Disposition_classifier_agnet import get_disposition
+
+# Batch disposition router streams dispositions for many transcripts in one request
+router = APIRouter()
+
+# Default and maximum number of transcripts classified at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+# NDJSON bodies larger than this many bytes are spooled to a temporary file
+BATCH_SPOOL_SIZE = int(os.getenv("BATCH_SPOOL_SIZE", str(8 * 1024 * 1024)))
+
+# Batch item is a single transcript in a batch, tagged with the id echoed back in its result
+class BatchItem(BaseModel):
+    id: Optional[Union[str, int]] = None
+    transcript: List[Dict[str, Any]]
+
+# Parse item is a function that turns one raw batch entry into a BatchItem (or an error line)
+def _parse_item(raw: Any, index: int) -> Union[BatchItem, Dict[str, Any]]:
+    try:
+        if isinstance(raw, (str, bytes)):
+            raw = json.loads(raw)
+        if isinstance(raw, list):
+            raw = {"transcript": raw}
+        item = BatchItem.model_validate(raw)
+    except (ValueError, ValidationError) as e:
+        item_id = raw.get("id", index) if isinstance(raw, dict) else index
+        return {"id": item_id, "error": f"Invalid batch item: {e}"}
+    if item.id is None:
+        item.id = index
+    return item
+
+# Read lines is a function that splits a stream of byte chunks into NDJSON lines lazily
+async def _read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+# File chunks is a function that reads a (spooled) file in fixed-size chunks
+async def _file_chunks(file, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        yield chunk
+    file.close()
+
+# NDJSON items is a function that yields batch items from NDJSON lines
+async def _ndjson_items(lines: AsyncIterator[bytes]) -> AsyncIterator[Union[BatchItem, Dict[str, Any]]]:
+    index = 0
+    async for line in lines:
+        yield _parse_item(line, index)
+        index += 1
+
+# List items is a function that yields batch items from an already parsed JSON list
+async def _list_items(body: List[Any]) -> AsyncIterator[Union[BatchItem, Dict[str, Any]]]:
+    for index, raw in enumerate(body):
+        yield _parse_item(raw, index)
+
+# Open batch is a function that reads the request body (JSON list, {"items": [...]}, NDJSON body or NDJSON upload)
+# before streaming starts; NDJSON is spooled to disk so large uploads are not held in memory
+async def _open_batch(request: Request) -> AsyncIterator[Union[BatchItem, Dict[str, Any]]]:
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" in content_type:
+        form = await request.form()
+        upload = next((v for v in form.values() if hasattr(v, "read")), None)
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Multipart batch must include an NDJSON file")
+        return _ndjson_items(_read_lines(_file_chunks(upload.file)))
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        spool = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_SIZE)
+        async for chunk in request.stream():
+            spool.write(chunk)
+        return _ndjson_items(_read_lines(_file_chunks(spool)))
+    try:
+        body = await request.json()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if isinstance(body, dict):
+        body = body.get("items", [])
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a list of transcripts")
+    return _list_items(body)
+
+# Dispose item is a function that runs the disposition pipeline for one batch item without raising
+async def _dispose_item(item: Union[BatchItem, Dict[str, Any]]) -> Dict[str, Any]:
+    if not isinstance(item, BatchItem):
+        return item
+    try:
+        result = await get_disposition(item.transcript)
+        return {"id": item.id, "result": result.model_dump()}
+    except Exception as e:
+        loguru.logger.exception(f"Batch item {item.id} failed")
+        return {"id": item.id, "error": str(e)}
+
+# Stream batch is a function that classifies batch items with a fixed worker pool and yields NDJSON in completion order
+async def stream_batch(items: AsyncIterator[Union[BatchItem, Dict[str, Any]]], concurrency: int) -> AsyncIterator[str]:
+    # Bounded input queue keeps at most `concurrency` parsed items waiting, so large uploads are read lazily
+    inputs: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def producer():
+        try:
+            async for item in items:
+                await inputs.put(item)
+        except Exception as e:
+            loguru.logger.exception("Batch input could not be read")
+            await results.put({"id": None, "error": f"Batch input could not be read: {e}"})
+        finally:
+            for _ in range(concurrency):
+                await inputs.put(None)
+
+    async def worker():
+        while (item := await inputs.get()) is not None:
+            await results.put(await _dispose_item(item))
+
+    async def run():
+        await asyncio.gather(producer(), *[worker() for _ in range(concurrency)])
+        await results.put(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while (line := await results.get()) is not None:
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+    finally:
+        # Client went away: stop reading input and cancel in-flight items
+        runner.cancel()
+
+# Batch disposition endpoint streams one NDJSON line per transcript, in completion order, tagged with its id
+@router.post("/disposition/batch")
+async def get_disposition_batch(request: Request, concurrency: Optional[int] = None) -> StreamingResponse:
+    concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    loguru.logger.info(f"Batch disposition started with concurrency {concurrency}")
+    items = await _open_batch(request)
+    return StreamingResponse(
+        stream_batch(items, concurrency),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,244 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import re
+from typing import Any, Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Fake OpenAI server is a local stand-in for the chat completions API, so the disposition pipeline can be
+# benchmarked and regression-tested without an API key. Point every ChatOpenAI at it with
+# OPENAI_BASE_URL=http://localhost:8001/v1 (any OPENAI_API_KEY value works).
+#
+# Answers are deterministic for a given request: structured outputs (json_schema response_format or a
+# structured-output tool call) are filled from the schema, picking codes from the table in the prompt.
+# Latency, streaming speed and injected failures (429, 500, timeouts) are configurable.
+
+app = FastAPI()
+
+# Server config, set from the command line in main()
+CONFIG = {
+    "latency_ms": 300.0,
+    "jitter_ms": 100.0,
+    "token_delay_ms": 5.0,
+    "error_429_rate": 0.0,
+    "error_500_rate": 0.0,
+    "timeout_rate": 0.0,
+    "timeout_seconds": 120.0,
+    "rpm_limit": 10000,
+    "tpm_limit": 2000000,
+}
+rng = random.Random(0)
+
+# Table code pattern matches the "CODE: X |" rows of the disposition and grievance tables
+CODE_PATTERN = re.compile(r"CODE: ([A-Z0-9_() ]+?) \|")
+IVR_WORDS = ("ringing", "busy", "switched off", "not reachable", "no answer", "does not exist", "network error")
+
+# Message text is a function that flattens message content (string or content parts) into text
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+# Estimate tokens is a function that approximates token counts at four characters per token
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+# Context is a function that derives the deterministic inputs for one request
+def _context(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    system = " ".join(_message_text(m) for m in messages if m.get("role") in ("system", "developer"))
+    user = _message_text(next((m for m in reversed(messages) if m.get("role") == "user"), {}))
+    codes = CODE_PATTERN.findall(user) or CODE_PATTERN.findall(system)
+    digest = int(hashlib.sha256((system + user).encode("utf-8")).hexdigest(), 16)
+    return {"system": system, "user": user, "codes": codes, "digest": digest}
+
+# Resolve is a function that follows a local "$ref" into the schema's $defs
+def _resolve(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    ref = schema.get("$ref")
+    if ref:
+        for part in ref.lstrip("#/").split("/"):
+            root = root[part]
+        return root
+    return schema
+
+# Fill is a function that builds a deterministic value that satisfies a JSON schema
+def _fill(schema: Dict[str, Any], root: Dict[str, Any], ctx: Dict[str, Any], name: str = "") -> Any:
+    schema = _resolve(schema, root)
+    if "anyOf" in schema:
+        options = [s for s in schema["anyOf"] if _resolve(s, root).get("type") != "null"]
+        if name == "grievance_code" and ctx.get("disposition") != "GRIEVANCE":
+            return None
+        return _fill(options[0], root, ctx, name) if options else None
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        result = {}
+        for key, sub in schema.get("properties", {}).items():
+            result[key] = _fill(sub, root, ctx, key)
+            if key == "Disposition_code":
+                ctx["disposition"] = result[key]
+        return result
+    if kind == "array":
+        return [_fill(schema.get("items", {"type": "string"}), root, ctx, f"{name} {i + 1}") for i in range(2)]
+    if kind in ("number", "integer"):
+        return round(0.5 + (ctx["digest"] % 50) / 100, 2) if name == "confidence" else 1
+    if kind == "boolean":
+        return True
+    if name == "Disposition_code":
+        codes = ctx["codes"] or ["UNKNOWN"]
+        return codes[ctx["digest"] % len(codes)]
+    if name == "grievance_code":
+        return "LOAN_NOT_TAKEN"
+    if name == "summary":
+        return _summary(ctx)
+    return f"stub {name}".strip()
+
+# Summary is a function that returns a deterministic plain-text summary
+def _summary(ctx: Dict[str, Any]) -> str:
+    return (
+        "The lender called the borrower about the pending EMI. "
+        f"The borrower responded during a conversation of about {_estimate_tokens(ctx['user'])} tokens. "
+        "The call ended normally."
+    )
+
+# Respond is a function that builds the assistant message for a chat completions request
+def _respond(body: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = _context(body.get("messages", []))
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        return {"role": "assistant", "content": json.dumps(_fill(schema, schema, ctx))}
+    if body.get("tools"):
+        tool = body["tools"][0]["function"]
+        schema = tool.get("parameters", {})
+        arguments = json.dumps(_fill(schema, schema, ctx))
+        call_id = f"call_{ctx['digest'] % 10**12}"
+        return {"role": "assistant", "content": None, "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": tool["name"], "arguments": arguments}}
+        ]}
+    if "NOT CONNECTED" in ctx["system"] and "Respond ONLY" in ctx["system"]:
+        transcript = ctx["system"].lower()
+        return {"role": "assistant", "content": "NOT CONNECTED" if any(w in transcript for w in IVR_WORDS) else "CONNECTED"}
+    return {"role": "assistant", "content": _summary(ctx)}
+
+# Pick fault is a function that decides whether to inject a failure into this request
+def _pick_fault() -> Optional[str]:
+    roll = rng.random()
+    for fault, rate in (("429", CONFIG["error_429_rate"]), ("500", CONFIG["error_500_rate"]), ("timeout", CONFIG["timeout_rate"])):
+        if roll < rate:
+            return fault
+        roll -= rate
+    return None
+
+# Rate limit headers mimic the x-ratelimit-* headers the real API sends
+def _rate_limit_headers() -> Dict[str, str]:
+    return {
+        "x-ratelimit-limit-requests": str(CONFIG["rpm_limit"]),
+        "x-ratelimit-remaining-requests": str(CONFIG["rpm_limit"] - 1),
+        "x-ratelimit-limit-tokens": str(CONFIG["tpm_limit"]),
+        "x-ratelimit-remaining-tokens": str(CONFIG["tpm_limit"] - 1000),
+    }
+
+# Stream chunks is a function that yields the assistant message as chat.completion.chunk SSE events
+async def _stream_chunks(body: Dict[str, Any], completion_id: str, message: Dict[str, Any], usage: Dict[str, int]):
+    model = body.get("model")
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    if message.get("tool_calls"):
+        yield chunk({"tool_calls": [{"index": 0, **message["tool_calls"][0]}]})
+    else:
+        for word in re.findall(r"\S+\s*", message["content"]):
+            await asyncio.sleep(CONFIG["token_delay_ms"] / 1000)
+            yield chunk({"content": word})
+    yield chunk({}, "tool_calls" if message.get("tool_calls") else "stop")
+    if (body.get("stream_options") or {}).get("include_usage"):
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                   "choices": [], "usage": usage}
+        yield f"data: {json.dumps(payload)}\n\n"
+    yield "data: [DONE]\n\n"
+
+# Chat completions endpoint answers like POST /v1/chat/completions
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    fault = _pick_fault()
+    await asyncio.sleep(max(0.0, rng.gauss(CONFIG["latency_ms"], CONFIG["jitter_ms"])) / 1000)
+    if fault == "429":
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}},
+            headers={**_rate_limit_headers(), "retry-after": "1", "x-ratelimit-remaining-requests": "0"},
+        )
+    if fault == "500":
+        return JSONResponse(status_code=500, content={"error": {"message": "Internal error (stub)", "type": "server_error"}})
+    if fault == "timeout":
+        await asyncio.sleep(CONFIG["timeout_seconds"])
+        return JSONResponse(status_code=504, content={"error": {"message": "Timed out (stub)", "type": "timeout"}})
+
+    message = _respond(body)
+    prompt_text = " ".join(_message_text(m) for m in body.get("messages", []))
+    completion_text = message.get("content") or json.dumps(message.get("tool_calls"))
+    usage = {
+        "prompt_tokens": _estimate_tokens(prompt_text),
+        "completion_tokens": _estimate_tokens(completion_text),
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    completion_id = f"chatcmpl-stub-{rng.getrandbits(48):x}"
+
+    if body.get("stream"):
+        return StreamingResponse(
+            _stream_chunks(body, completion_id, message, usage), media_type="text/event-stream", headers=_rate_limit_headers()
+        )
+    return JSONResponse(
+        content={
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+            "usage": usage,
+        },
+        headers=_rate_limit_headers(),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible chat completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"], help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=CONFIG["jitter_ms"], help="latency standard deviation")
+    parser.add_argument("--token-delay-ms", type=float, default=CONFIG["token_delay_ms"], help="delay between streamed tokens")
+    parser.add_argument("--error-429-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-500-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests that hang for --timeout-seconds")
+    parser.add_argument("--timeout-seconds", type=float, default=CONFIG["timeout_seconds"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    CONFIG.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "token_delay_ms": args.token_delay_ms,
+        "error_429_rate": args.error_429_rate,
+        "error_500_rate": args.error_500_rate,
+        "timeout_rate": args.timeout_rate,
+        "timeout_seconds": args.timeout_seconds,
+    })
+    rng.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
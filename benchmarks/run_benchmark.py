@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+import httpx
+
+# Run benchmark drives /disposition, /disposition/stream and /disposition/batch at fixed concurrency levels
+# with the recorded transcripts in benchmarks/transcripts.jsonl and reports throughput, p50/p95/p99 latency
+# and the per-stage breakdown from the Server-Timing header. Results can be saved as a JSON baseline and
+# compared against a previous one.
+#
+# With --spawn it starts benchmarks/fake_openai_server.py and the API itself, so no OpenAI key is needed.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Load transcripts is a function that reads the recorded {"id", "size", "transcript"} rows
+def load_transcripts(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Percentile is a function that returns the p-th percentile (0-100) of a list of numbers
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = (len(values) - 1) * p / 100
+    low = int(index)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (index - low)
+
+# Parse server timing is a function that turns a Server-Timing header into {stage: ms}
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+# Summarize is a function that reduces raw samples to the reported statistics
+def summarize(latencies: List[float], errors: int, wall_seconds: float, stages: Dict[str, List[float]], extra: Optional[Dict[str, List[float]]] = None) -> Dict[str, Any]:
+    count = len(latencies) + errors
+    report = {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {f"p{p}": round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)},
+        "stages_mean_ms": {stage: round(sum(v) / len(v), 1) for stage, v in stages.items() if v},
+    }
+    for name, values in (extra or {}).items():
+        report[name] = {f"p{p}": round(percentile(values, p) * 1000, 1) for p in (50, 95, 99)}
+    return report
+
+# Bench disposition is a function that sends `requests` POST /disposition calls at a fixed concurrency
+async def bench_disposition(client: httpx.AsyncClient, rows: List[Dict[str, Any]], concurrency: int, requests: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, stages, errors = [], defaultdict(list), 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/disposition", params={"cache": "bypass"}, json=rows[i % len(rows)]["transcript"])
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            for stage, ms in parse_server_timing(response.headers.get("server-timing")).items():
+                stages[stage].append(ms)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return summarize(latencies, errors, time.perf_counter() - start, stages)
+
+# Bench stream is a function that measures time to first event and total time of /disposition/stream
+async def bench_stream(client: httpx.AsyncClient, rows: List[Dict[str, Any]], concurrency: int, requests: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_event, errors = [], [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            try:
+                async with client.stream("POST", "/disposition/stream", json=rows[i % len(rows)]["transcript"]) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if line.startswith("event:"):
+                            first = first or time.perf_counter() - start
+                            if line == "event: error":
+                                raise httpx.HTTPError("stream error event")
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            first_event.append(first or 0.0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return summarize(latencies, errors, time.perf_counter() - start, {}, {"time_to_first_event_ms": first_event})
+
+# Bench batch is a function that sends one /disposition/batch request of `requests` items at the given concurrency
+async def bench_batch(client: httpx.AsyncClient, rows: List[Dict[str, Any]], concurrency: int, requests: int) -> Dict[str, Any]:
+    items = [{"id": i, "transcript": rows[i % len(rows)]["transcript"]} for i in range(requests)]
+    arrivals, errors = [], 0
+    start = time.perf_counter()
+    async with client.stream("POST", "/disposition/batch", params={"concurrency": concurrency}, json=items) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            if "error" in json.loads(line):
+                errors += 1
+            else:
+                arrivals.append(time.perf_counter() - start)
+    wall = time.perf_counter() - start
+    report = summarize(arrivals, errors, wall, {})
+    # Items of a batch have no individual start time, so "latency" is the time until each result line arrived
+    report["latency_ms"] = {**report["latency_ms"], "note": "time from batch start until each line arrived"}
+    return report
+
+BENCHES = {"disposition": bench_disposition, "stream": bench_stream, "batch": bench_batch}
+
+# Compare is a function that prints the change of each endpoint/level against a previous baseline
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print("\nComparison with baseline:")
+    for endpoint, levels in current["results"].items():
+        for level, report in levels.items():
+            previous = baseline.get("results", {}).get(endpoint, {}).get(level)
+            if not previous:
+                continue
+            deltas = []
+            for key in ("p50", "p95", "p99"):
+                old, new = previous["latency_ms"][key], report["latency_ms"][key]
+                deltas.append(f"{key} {old:.0f}->{new:.0f}ms ({(new - old) / old * 100 if old else 0:+.1f}%)")
+            old, new = previous["throughput_rps"], report["throughput_rps"]
+            deltas.append(f"rps {old}->{new} ({(new - old) / old * 100 if old else 0:+.1f}%)")
+            print(f"  {endpoint:<12} c={level:<4} " + ", ".join(deltas))
+
+# Wait until up is a function that polls a URL until it answers or the timeout expires
+def wait_until_up(url: str, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.25)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+# Spawn is a function that starts the fake OpenAI server and the API pointed at it
+def spawn(args) -> List[subprocess.Popen]:
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai_server.py"),
+        "--port", str(args.stub_port), "--latency-ms", str(args.stub_latency_ms), "--jitter-ms", str(args.stub_jitter_ms),
+        "--error-429-rate", str(args.stub_error_429_rate),
+    ])
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.stub_port}/v1",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "stub",
+        "OPENAI_MODEL": os.getenv("OPENAI_MODEL") or "gpt-4o-mini",
+        "CACHE_ENABLED": "false",
+    }
+    port = args.url.rsplit(":", 1)[-1].strip("/")
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", port, "--log-level", "warning"], cwd=ROOT, env=env)
+    wait_until_up(f"http://127.0.0.1:{args.stub_port}/docs")
+    wait_until_up(args.url)
+    return [stub, api]
+
+async def run(args) -> Dict[str, Any]:
+    rows = load_transcripts(args.transcripts)
+    if args.size:
+        rows = [row for row in rows if row.get("size") == args.size]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results: Dict[str, Dict[str, Any]] = defaultdict(dict)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        for endpoint in args.endpoints.split(","):
+            for level in levels:
+                report = await BENCHES[endpoint](client, rows, level, args.requests)
+                results[endpoint][str(level)] = report
+                latency = report["latency_ms"]
+                print(f"{endpoint:<12} c={level:<4} {report['throughput_rps']:>7.2f} req/s  "
+                      f"p50 {latency['p50']:>8.1f}ms  p95 {latency['p95']:>8.1f}ms  p99 {latency['p99']:>8.1f}ms  "
+                      f"errors {report['errors']}")
+                if "time_to_first_event_ms" in report:
+                    print(f"    time to first event: p50 {report['time_to_first_event_ms']['p50']}ms, p95 {report['time_to_first_event_ms']['p95']}ms")
+                if report["stages_mean_ms"]:
+                    print("    stages: " + ", ".join(f"{k} {v}ms" for k, v in report["stages_mean_ms"].items()))
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "url": args.url,
+            "requests_per_level": args.requests,
+            "transcripts": args.transcripts,
+            "size": args.size,
+            "spawned_stub": args.spawn,
+            "stub_latency_ms": args.stub_latency_ms if args.spawn else None,
+        },
+        "results": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the disposition API at fixed concurrency levels")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--transcripts", default=os.path.join(ROOT, "benchmarks", "transcripts.jsonl"))
+    parser.add_argument("--size", choices=["short", "medium", "long"], help="only use transcripts of this size")
+    parser.add_argument("--endpoints", default="disposition,stream,batch")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per endpoint and level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write the results to this JSON file (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="compare the results with this earlier JSON file")
+    parser.add_argument("--spawn", action="store_true", help="start the fake OpenAI server and the API locally")
+    parser.add_argument("--stub-port", type=int, default=8001)
+    parser.add_argument("--stub-latency-ms", type=float, default=300.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--stub-error-429-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes = spawn(args) if args.spawn else []
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import loguru
+
+# Bulk disposition re-disposes archived transcripts (JSONL or CSV files on local disk) without the HTTP layer.
+# Input is read lazily and fanned out in batches across a pool of worker processes; each worker runs the
+# pipeline from Disposition_classifier_agnet with its own concurrency limit. Results are written incrementally
+# to JSONL or Parquet, and the ids of written rows go to a checkpoint file, so an interrupted run started again
+# with the same arguments skips the rows it already paid for.
+#
+#   python bulk_disposition.py calls-2024-*.jsonl --output dispositions.jsonl --workers 4 --concurrency 8
+
+# CSV transcript columns hold whole calls as JSON, which can exceed the default field size limit
+csv.field_size_limit(sys.maxsize)
+
+# Row is (id, transcript, approximate input bytes)
+Row = Tuple[str, List[Dict[str, Any]], int]
+
+# Read JSONL is a function that lazily yields rows from a JSONL file of {"id", "transcript"} objects or bare transcripts
+def read_jsonl(path: str) -> Iterator[Row]:
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            raw = json.loads(line)
+            if isinstance(raw, list):
+                raw = {"transcript": raw}
+            yield str(raw.get("id", f"{path}:{index}")), raw["transcript"], len(line.encode("utf-8"))
+
+# Read CSV is a function that lazily yields rows from a CSV file whose transcript column holds the transcript as JSON
+def read_csv(path: str, id_column: str, transcript_column: str) -> Iterator[Row]:
+    with open(path, encoding="utf-8", newline="") as f:
+        for index, raw in enumerate(csv.DictReader(f)):
+            size = sum(len(value or "") + 1 for value in raw.values())
+            yield str(raw.get(id_column) or f"{path}:{index}"), json.loads(raw[transcript_column]), size
+
+# Read inputs is a function that chains the rows of all input files, in order
+def read_inputs(paths: List[str], id_column: str, transcript_column: str) -> Iterator[Row]:
+    for path in paths:
+        if path.lower().endswith(".csv"):
+            yield from read_csv(path, id_column, transcript_column)
+        else:
+            yield from read_jsonl(path)
+
+# Batches is a function that groups rows into lists of at most `size`, skipping ids that are already done
+def batches(rows: Iterator[Row], done: Set[str], size: int, progress: "Progress") -> Iterator[List[Row]]:
+    batch = []
+    for row in rows:
+        if row[0] in done:
+            progress.skip(row[2])
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Checkpoint records the ids of rows whose results are written to the output, one id per line
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def add(self, ids: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{row_id}\n" for row_id in ids))
+            f.flush()
+            os.fsync(f.fileno())
+
+# JSONL writer appends result rows to a JSONL file
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+
+# Parquet writer writes each flush as a new part file in the output directory (Parquet files cannot be appended to).
+# Every part has the same explicit schema, so the directory reads as one dataset even when a flush has only null
+# summaries; model_tiers is stored as a JSON string because its keys differ between rows.
+class ParquetWriter:
+    def __init__(self, path: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.string()),
+            ("Disposition_code", pyarrow.string()),
+            ("confidence", pyarrow.float64()),
+            ("explanation", pyarrow.string()),
+            ("summary", pyarrow.string()),
+            ("key_points", pyarrow.list_(pyarrow.string())),
+            ("model_tiers", pyarrow.string()),
+        ])
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        part_path = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        # Written under a temporary name first, so a crash never leaves a truncated part behind
+        rows = [{**row, "model_tiers": json.dumps(row["model_tiers"]) if row.get("model_tiers") else None} for row in rows]
+        self.pq.write_table(self.pa.Table.from_pylist(rows, schema=self.schema), part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        self.part += 1
+
+# Error log holds the latest error of every row that has not succeeded yet, one per id. It is rewritten (atomically)
+# rather than appended to, so a resumed run that fails the same rows again does not repeat them, and rows that
+# succeed on a retry are removed.
+class ErrorLog:
+    def __init__(self, path: str, done: Set[str]):
+        self.path = path
+        self.errors: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        if row.get("id") not in done:
+                            self.errors[row.get("id")] = row
+            self._save()
+
+    def record(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self.errors[row["id"]] = row
+        self._save()
+
+    def resolve(self, ids: List[str]) -> None:
+        if any(self.errors.pop(row_id, None) is not None for row_id in ids):
+            self._save()
+
+    def _save(self) -> None:
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in self.errors.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+# Result sink buffers finished rows and flushes them to the output, then the checkpoint, every `flush_every` rows.
+# Failed rows go to the error log and are not checkpointed, so a resumed run retries them.
+class ResultSink:
+    def __init__(self, writer, checkpoint: Checkpoint, errors: ErrorLog, flush_every: int):
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.errors = errors
+        self.flush_every = flush_every
+        self.rows: List[Dict[str, Any]] = []
+
+    def add(self, results: List[Dict[str, Any]]) -> None:
+        errors = [r for r in results if "error" in r]
+        if errors:
+            self.errors.record(errors)
+        self.rows.extend(r for r in results if "error" not in r)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        ids = [row["id"] for row in self.rows]
+        self.writer.write(self.rows)
+        self.checkpoint.add(ids)
+        self.errors.resolve(ids)
+        self.rows = []
+
+# Progress tracks finished rows and reports throughput and an ETA estimated from the input bytes left
+class Progress:
+    def __init__(self, total_bytes: int, interval: float):
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.start = self.last_report = time.perf_counter()
+        self.done = self.errors = self.skipped = 0
+        self.done_bytes = self.skipped_bytes = 0
+
+    def skip(self, size: int) -> None:
+        self.skipped += 1
+        self.skipped_bytes += size
+
+    def finish(self, results: List[Dict[str, Any]], size: int) -> None:
+        self.errors += sum("error" in r for r in results)
+        self.done += len(results)
+        self.done_bytes += size
+        if time.perf_counter() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self, final: bool = False) -> None:
+        self.last_report = time.perf_counter()
+        elapsed = self.last_report - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        remaining = max(0, self.total_bytes - self.done_bytes - self.skipped_bytes)
+        byte_rate = self.done_bytes / elapsed if elapsed else 0.0
+        eta = f"{remaining / byte_rate:.0f}s" if byte_rate and not final else "-"
+        loguru.logger.info(
+            f"{'finished' if final else 'progress'}: {self.done} done ({self.errors} errors), {self.skipped} skipped, "
+            f"{rate:.2f} rows/s, elapsed {elapsed:.0f}s, ETA {eta}"
+        )
+
+# Worker state: each worker process keeps one event loop, since the model clients are bound to the loop they first ran on
+_worker: Dict[str, Any] = {}
+
+# Init worker is a function that imports the pipeline once per worker process and sets its concurrency limit
+def _init_worker(concurrency: int, cache: str, mode: Optional[str], log_level: str, workers: int) -> None:
+    # Ctrl-C reaches the whole process group; only the main process handles it, so in-flight batches can finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level=log_level)
+    from Disposition_classifier_agnet import get_disposition
+    from llm_gateway import gateway
+    from T2T_agent import load_token_encoding
+    load_token_encoding()
+    # Each worker has its own LLM gateway; the RPM/TPM budgets and concurrency are split between them
+    gateway.split(workers)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _worker.update(loop=loop, semaphore=asyncio.Semaphore(concurrency), get_disposition=get_disposition, cache=cache, mode=mode)
+
+# Dispose row is a function that classifies one row under the worker's concurrency limit
+async def _dispose_row(row_id: str, transcript: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async with _worker["semaphore"]:
+        try:
+            result = await _worker["get_disposition"](transcript, cache=_worker["cache"], mode=_worker["mode"])
+        except Exception as e:
+            return {"id": row_id, "error": str(e)}
+    return {"id": row_id, **result.model_dump()}
+
+# Dispose batch is a function that classifies a batch of rows concurrently inside a worker process
+def _dispose_batch(batch: List[Tuple[str, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    async def run():
+        return await asyncio.gather(*[_dispose_row(row_id, transcript) for row_id, transcript in batch])
+    return _worker["loop"].run_until_complete(run())
+
+# Run is a function that streams the input through the worker pool into the sink, keeping a bounded number of batches in flight
+def run(args) -> Progress:
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint")
+    done = checkpoint.load()
+    if done:
+        loguru.logger.info(f"Resuming: {len(done)} rows already in {checkpoint.path}")
+    writer = ParquetWriter(args.output) if output_format == "parquet" else JsonlWriter(args.output)
+    sink = ResultSink(writer, checkpoint, ErrorLog(args.errors or f"{args.output}.errors.jsonl", done), args.flush_every)
+    progress = Progress(sum(os.path.getsize(path) for path in args.inputs), args.progress_every)
+    rows = read_inputs(args.inputs, args.id_column, args.transcript_column)
+
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.concurrency, args.cache, args.mode, args.worker_log_level, args.workers),
+    )
+    pending = {}
+
+    def collect(futures) -> None:
+        for future in futures:
+            size = pending.pop(future)
+            results = future.result()
+            sink.add(results)
+            progress.finish(results, size)
+
+    try:
+        for batch in batches(rows, done, args.batch_size, progress):
+            # Two batches per worker keeps every worker busy without reading the input far ahead
+            if len(pending) >= args.workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            future = pool.submit(_dispose_batch, [(row_id, transcript) for row_id, transcript, _ in batch])
+            pending[future] = sum(size for _, _, size in batch)
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    except KeyboardInterrupt:
+        loguru.logger.warning("Interrupted: saving the batches already running, run again with the same arguments to resume")
+    finally:
+        # Batches a worker already started are paid for, so they are finished and written; queued ones are dropped
+        pool.shutdown(wait=True, cancel_futures=True)
+        collect([future for future in list(pending) if not future.cancelled() and future.exception() is None])
+        sink.flush()
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-dispose archived transcripts from JSONL/CSV files")
+    parser.add_argument("inputs", nargs="+", help="JSONL files of {id, transcript} rows, or CSV files with a JSON transcript column")
+    parser.add_argument("--output", required=True, help="JSONL file, or a directory of Parquet parts when it ends in .parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="output format (default: from the --output name)")
+    parser.add_argument("--checkpoint", help="ids of written rows (default: <output>.checkpoint)")
+    parser.add_argument("--errors", help="failed rows, retried on resume (default: <output>.errors.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="transcripts classified at the same time per worker")
+    parser.add_argument("--batch-size", type=int, default=32, help="rows sent to a worker at a time")
+    parser.add_argument("--flush-every", type=int, default=100, help="rows buffered before writing output and checkpoint")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="seconds between progress reports")
+    parser.add_argument("--mode", choices=["multi_stage", "single_pass"], help="classification mode (default: DISPOSITION_MODE)")
+    parser.add_argument("--cache", choices=["use", "bypass", "refresh"], default="use")
+    parser.add_argument("--id-column", default="id", help="CSV column holding the row id")
+    parser.add_argument("--transcript-column", default="transcript", help="CSV column holding the transcript JSON")
+    parser.add_argument("--worker-log-level", default="WARNING")
+    args = parser.parse_args()
+
+    progress = run(args)
+    progress.report(final=True)
+
+if __name__ == "__main__":
+    main()
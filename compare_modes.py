@@ -0,0 +1,66 @@
+import json
+import time
+import asyncio
+import argparse
+from Disposition_classifier_agnet import get_disposition, MULTI_STAGE, SINGLE_PASS
+
+# Compare modes runs every transcript through the multi-stage pipeline and the single-pass call
+# and reports how often they agree, plus the latency of each mode
+
+# Load transcripts is a function that reads {"id", "transcript"} rows from a JSONL file
+def load_transcripts(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Run mode is a function that classifies one transcript in the given mode, bypassing the result cache and the
+# pre-classifier (which would give both modes the same answer)
+async def run_mode(transcript, mode: str):
+    start = time.perf_counter()
+    result = await get_disposition(transcript, cache="bypass", mode=mode, preclassifier=False)
+    return result, time.perf_counter() - start
+
+# Compare one is a function that runs both modes for one row under the concurrency limit
+async def compare_one(row, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        multi, multi_seconds = await run_mode(row["transcript"], MULTI_STAGE)
+        single, single_seconds = await run_mode(row["transcript"], SINGLE_PASS)
+    return {
+        "id": row.get("id"),
+        "multi_stage": multi.Disposition_code,
+        "single_pass": single.Disposition_code,
+        "agree": multi.Disposition_code == single.Disposition_code,
+        "multi_stage_confidence": multi.confidence,
+        "single_pass_confidence": single.confidence,
+        "multi_stage_seconds": round(multi_seconds, 3),
+        "single_pass_seconds": round(single_seconds, 3),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Report agreement between multi-stage and single-pass classification")
+    parser.add_argument("--input", default="fixtures/connection_status_labelled.jsonl", help="JSONL rows with id and transcript")
+    parser.add_argument("--output", help="optional JSONL file for the per-transcript comparison")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    rows = load_transcripts(args.input)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = await asyncio.gather(*[compare_one(row, semaphore) for row in rows])
+
+    for r in results:
+        print(f"{str(r['id']):<10} {'=' if r['agree'] else 'x'} multi={r['multi_stage']:<40} single={r['single_pass']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+    count = len(results)
+    agree = sum(r["agree"] for r in results)
+    print(f"\ntranscripts: {count}")
+    print(f"agreement: {agree}/{count} ({agree / count:.0%})")
+    for mode in (MULTI_STAGE, SINGLE_PASS):
+        seconds = sorted(r[f"{mode}_seconds"] for r in results)
+        confidence = sum(r[f"{mode}_confidence"] for r in results) / count
+        print(f"{mode}: mean latency {sum(seconds) / count:.2f}s, p50 {seconds[count // 2]:.2f}s, mean confidence {confidence:.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
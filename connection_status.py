@@ -1,44 +1,198 @@
 import os
+from collections import Counter
 from dotenv import load_dotenv
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-from langchain_openai import ChatOpenAI
+from llm_gateway import chat_model
 from T2T_agent import preprocess_transcript
-from typing import List, Dict, Any
+from metrics import stage_timer, record_usage, register_fast_path
+from single_flight import SingleFlight
+from typing import List, Dict, Any, Optional, Tuple
 
 import loguru
 
-# Connection status agent is a agent that detects the connection status of the transcript
-def detect_connection_status(transcript: List[Dict[str, Any]]) -> str:
-    """First pass: Detect if call was CONNECTED using raw transcript patterns"""
-    transcript_text = preprocess_transcript(transcript).lower()
-    
-    # Rule-based + LLM hybrid for reliability on short transcripts
-    connected_indicators = [
-        "hello", "hi", "namaste", "yes", "no", "pay", "emi", "due", 
-        "family", "voicemail", "wrong", "deceased", "complaint"
-    ]
-    not_connected_indicators = ["ringing", "busy", "switched off", "unreachable", "no answer"]
-    
-    has_speech = any(word in transcript_text for word in connected_indicators)
-    if len(transcript_text.strip()) < 20 or not has_speech:
-        return "Not Connected"  # Default for minimal interaction
-    
-    # LLM confirmation for edge cases
-    status_model = ChatOpenAI(model=os.getenv("OPENAI_MODEL"), temperature=0)
-    status_prompt = """
+# Connection status values match the Connected_Status column of csv/General_disposition.csv
+CONNECTED = "Connected"
+NOT_CONNECTED = "Not Connected"
+
+# Connection status model is reused for every ambiguous call instead of being rebuilt per request
+status_model = chat_model(model=os.getenv("OPENAI_MODEL"), temperature=0)
+
+# Connection status prompt is a prompt that asks the model to confirm the connection status
+status_prompt = """
     CLASSIFY ONLY: Was this call CONNECTED (conversation happened) or NOT CONNECTED?
-    
+
     CONNECTED if: ANY human response beyond ringing/busy/unreachable
     NOT CONNECTED if: ringing, busy tone, switched off, no answer, network error
-    
+
     Transcript: {transcript}
-    
+
     Respond ONLY: "CONNECTED" or "NOT CONNECTED"
     """
-    
-    result = status_model.invoke([{"role": "system", "content": status_prompt.format(transcript=transcript_text)}])
-    res = result.content.strip()
-    loguru.logger.info(f"Connection Status: {res}")
-    return res
\ No newline at end of file
+
+# Connected indicators are phrases a borrower says once a human is on the line (English, Hinglish, Hindi)
+connected_indicators = [
+    "hello", "hi", "namaste", "yes", "no", "pay", "emi", "due",
+    "family", "voicemail", "wrong", "deceased", "complaint",
+    "haan", "haanji", "ji", "nahi", "nahin", "kal", "paisa", "paise", "bhej", "kar dunga", "kar dungi",
+    "bol raha", "bol rahi", "baat", "salary", "payment", "loan", "number galat",
+    "हाँ", "हां", "जी", "नहीं", "कल", "पैसे", "भुगतान", "किस्त", "बोल रहा", "बोल रही", "नमस्ते",
+]
+
+# Not connected indicators are IVR / telecom messages that only appear when no human answered
+not_connected_indicators = [
+    "switched off", "switch off", "unreachable", "not reachable", "out of coverage", "out of network",
+    "does not exist", "invalid number", "not in service", "network error", "please try again later",
+    "the number you have dialled", "the number you have dialed", "the number you are calling",
+    "call could not be completed", "all lines are busy",
+    "pahunch se bahar", "uplabdh nahi", "sampark nahi", "maujood nahi",
+    "स्विच ऑफ", "पहुंच से बाहर", "पहुँच से बाहर", "उपलब्ध नहीं", "संपर्क नहीं", "मौजूद नहीं", "आप जिस नंबर",
+]
+
+# Telecom words are IVR messages only inside a telecom phrase ("the number you have dialled is busy"); a borrower
+# says them too ("main busy hoon", "phone band hai"), so on their own they are speech
+telecom_words = [
+    "busy", "ringing", "no answer", "not answering", "vyast", "band hai", "व्यस्त", "बंद है",
+]
+telecom_context = [
+    "the number you", "number you have", "the person you are calling", "subscriber", "dialled", "dialed",
+    "try again later", "jis number", "call kar rahe hain", "जिस नंबर", "कॉल कर रहे हैं",
+]
+# Rule engine threshold: a connected margin at or beyond this decides Connected without the LLM
+RULE_CONNECTED_MARGIN = float(os.getenv("CONNECTION_RULE_CONNECTED_MARGIN", "3"))
+
+# Status path counts record how often each decision path fires (rule connected / rule not connected / llm)
+status_path_counts = Counter()
+
+# Get status path counts is a function that returns a snapshot of the decision path counters
+def get_status_path_counts() -> Dict[str, int]:
+    return dict(status_path_counts)
+
+register_fast_path("connection_status", get_status_path_counts)
+
+# Has phrase is a function that matches whole words/phrases so "no" does not fire on "not" or "number"
+def _has_phrase(text: str, phrase: str) -> bool:
+    start = text.find(phrase)
+    while start != -1:
+        end = start + len(phrase)
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        if not before.isalnum() and not after.isalnum():
+            return True
+        start = text.find(phrase, start + 1)
+    return False
+
+# Count phrases is a function that counts how many indicator phrases appear in the text
+def _count_phrases(text: str, phrases: List[str]) -> int:
+    return sum(1 for phrase in phrases if _has_phrase(text, phrase))
+
+# IVR phrases is a function that returns the telecom phrases in one turn: the unambiguous ones, plus telecom words
+# when the turn also has a telecom phrase around them
+def _ivr_phrases(turn: str) -> List[str]:
+    phrases = [phrase for phrase in not_connected_indicators if _has_phrase(turn, phrase)]
+    context = [phrase for phrase in telecom_context if _has_phrase(turn, phrase)]
+    words = [word for word in telecom_words if _has_phrase(turn, word)] if phrases or context else []
+    if not phrases and not words:
+        return []
+    return phrases + context + words
+
+# Strip phrases is a function that blanks out phrases so words inside them ("uplabdh nahi") are not counted again
+def _strip_phrases(text: str, phrases: List[str]) -> str:
+    for phrase in sorted(phrases, key=len, reverse=True):
+        text = text.replace(phrase, " ")
+    return text
+
+# Score connection is a function that scores a transcript on turn counts, role mix and indicator phrases
+def score_connection(transcript: List[Dict[str, Any]]) -> Dict[str, float]:
+    borrower_turns = [msg['content'].lower() for msg in transcript if msg.get('role') == 'user' and msg.get('content')]
+    lender_turns = [msg['content'].lower() for msg in transcript if msg.get('role') == 'assistant' and msg.get('content')]
+
+    ivr_hits = sum(len(_ivr_phrases(turn)) for turn in borrower_turns + lender_turns)
+    # Borrower turns that are themselves IVR messages ("the number you are calling is busy") are not speech
+    human_turns = [turn for turn in borrower_turns if not _ivr_phrases(turn)]
+    speech_hits = _count_phrases(" ".join(human_turns), connected_indicators)
+    # A substantive turn has a few words beyond a bare greeting
+    substantive_turns = sum(1 for turn in human_turns if len(turn.split()) >= 3)
+    # A mixed turn has both an IVR message and borrower speech ("hello? the number you are calling is busy")
+    mixed_turns = sum(
+        1 for turn in borrower_turns
+        if turn not in human_turns and _count_phrases(_strip_phrases(turn, _ivr_phrases(turn)), connected_indicators)
+    )
+
+    connected_score = min(substantive_turns, 5) * 1.5 + min(speech_hits, 4) * 0.5
+    if borrower_turns and lender_turns:
+        connected_score += 1  # both sides spoke
+    not_connected_score = min(ivr_hits, 3) * 2.0
+    if not borrower_turns:
+        not_connected_score += 2  # nobody answered the lender
+    return {
+        "borrower_turns": len(borrower_turns),
+        "human_turns": len(human_turns),
+        "substantive_turns": substantive_turns,
+        "speech_hits": speech_hits,
+        "ivr_hits": ivr_hits,
+        "mixed_turns": mixed_turns,
+        "connected_score": connected_score,
+        "not_connected_score": not_connected_score,
+    }
+
+# Rule status is a function that decides the connection status without the LLM when the evidence is clear-cut.
+# Not Connected is only decided when nobody but the IVR spoke: no borrower turns, or only telecom messages.
+# Short human replies ("Speaking", "Call later", "Okay bye") are left to the LLM.
+def rule_status(transcript: List[Dict[str, Any]]) -> Tuple[Optional[str], Dict[str, float]]:
+    scores = score_connection(transcript)
+    if scores["mixed_turns"]:
+        return None, scores
+    if scores["human_turns"] == 0:
+        return NOT_CONNECTED, scores
+
+    margin = scores["connected_score"] - scores["not_connected_score"]
+    if margin >= RULE_CONNECTED_MARGIN:
+        return CONNECTED, scores
+    return None, scores
+
+# Normalize status is a function that maps the LLM answer onto the disposition table status values
+def normalize_status(answer: str) -> str:
+    answer = answer.strip().strip('"').upper()
+    if "NOT" in answer:
+        return NOT_CONNECTED
+    if "CONNECTED" in answer:
+        return CONNECTED
+    loguru.logger.warning(f"Unexpected connection status answer: {answer}")
+    return CONNECTED
+
+# Record rule is a function that counts and logs a rule-path decision
+def _record_rule(status: str, scores: Dict[str, float]) -> str:
+    status_path_counts["rule_connected" if status == CONNECTED else "rule_not_connected"] += 1
+    loguru.logger.info(f"Connection Status (rule): {status} {scores}")
+    return status
+
+# Record llm is a function that counts, normalizes and logs an LLM-path decision
+def _record_llm(answer: str, scores: Dict[str, float]) -> str:
+    status_path_counts["llm"] += 1
+    status = normalize_status(answer)
+    loguru.logger.info(f"Connection Status (llm): {status} {scores}")
+    return status
+
+# Status flight shares one LLM status check between concurrent calls for the same transcript
+status_flight = SingleFlight("connection_status")
+
+# Status LLM is a function that asks the status model about a transcript the rules could not decide
+async def _astatus_llm(transcript_text: str) -> str:
+    result = await status_model.ainvoke([{"role": "system", "content": status_prompt.format(transcript=transcript_text)}])
+    record_usage("connection_status", result)
+    return result.content
+
+# Async connection status agent is a agent that detects the connection status of the transcript
+async def adetect_connection_status(transcript: List[Dict[str, Any]]) -> str:
+    """First pass: Detect if call was CONNECTED without blocking the event loop"""
+    with stage_timer("connection_status"):
+        status, scores = rule_status(transcript)
+        if status is not None:
+            return _record_rule(status, scores)
+
+        # LLM confirmation for edge cases
+        transcript_text = preprocess_transcript(transcript).lower()
+        answer = await status_flight.run(transcript_text, lambda: _astatus_llm(transcript_text))
+        return _record_llm(answer, scores)
@@ -0,0 +1,45 @@
+import json
+import argparse
+from connection_status import rule_status, normalize_status, status_model, status_prompt
+from T2T_agent import preprocess_transcript
+
+# Evaluate connection status compares the rule fast path against the labels (and optionally the LLM)
+# on the labelled fixture set in fixtures/connection_status_labelled.jsonl
+
+# Load fixtures is a function that reads the labelled JSONL fixture set
+def load_fixtures(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# LLM status is a function that asks the connection status model directly, bypassing the rules
+def llm_status(transcript) -> str:
+    transcript_text = preprocess_transcript(transcript).lower()
+    result = status_model.invoke([{"role": "system", "content": status_prompt.format(transcript=transcript_text)}])
+    return normalize_status(result.content)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the connection status rule path against labelled fixtures")
+    parser.add_argument("--fixtures", default="fixtures/connection_status_labelled.jsonl")
+    parser.add_argument("--llm", action="store_true", help="also call the LLM on every fixture and report rule/LLM agreement")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    decided = agree_label = agree_llm = 0
+    for row in fixtures:
+        status, scores = rule_status(row["transcript"])
+        llm = llm_status(row["transcript"]) if args.llm else None
+        if status is not None:
+            decided += 1
+            agree_label += status == row["label"]
+            agree_llm += status == llm
+        print(f"{row['id']:<6} label={row['label']:<14} rule={str(status):<14}" + (f" llm={llm}" if args.llm else ""))
+
+    print(f"\nfixtures: {len(fixtures)}")
+    print(f"rule path decided: {decided} ({decided / len(fixtures):.0%}), rest go to the LLM")
+    if decided:
+        print(f"rule agrees with label: {agree_label}/{decided}")
+        if args.llm:
+            print(f"rule agrees with LLM: {agree_llm}/{decided}")
+
+if __name__ == "__main__":
+    main()
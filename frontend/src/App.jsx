@@ -9,13 +9,47 @@ function App() {
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null)
 
+  // Apply one Server-Sent Event from /disposition/stream to the partial results
+  const applyEvent = (event, data) => {
+    switch (event) {
+      case 'connection_status':
+        setResults((prev) => ({ ...prev, connection_status: data.connection_status, summary: '' }))
+        break
+      case 'summary':
+        setResults((prev) => ({ ...prev, summary: (prev?.summary || '') + data.token }))
+        break
+      case 'disposition':
+      case 'grievance':
+        setResults((prev) => ({ ...prev, ...data }))
+        break
+      case 'done':
+        setResults((prev) => ({ ...prev, ...data, done: true }))
+        break
+      case 'error':
+        throw new Error(data.detail || 'Failed to classify disposition')
+      default:
+        break
+    }
+  }
+
+  // Parse one raw SSE block ("event: ...\ndata: ...") into its event name and JSON data
+  const parseEvent = (block) => {
+    let event = 'message'
+    const dataLines = []
+    for (const line of block.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim()
+      else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim())
+    }
+    return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} }
+  }
+
   const handleSubmit = async (transcript) => {
     setLoading(true)
     setError(null)
     setResults(null)
 
     try {
-      const response = await fetch('http://localhost:8000/disposition', {
+      const response = await fetch('http://localhost:8000/disposition/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -28,8 +62,22 @@ function App() {
         throw new Error(errorData.detail || 'Failed to classify disposition')
       }
 
-      const data = await response.json()
-      setResults(data)
+      // Render each pipeline stage as soon as its event arrives
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const blocks = buffer.split('\n\n')
+        buffer = blocks.pop()
+        for (const block of blocks) {
+          if (!block.trim()) continue
+          const { event, data } = parseEvent(block)
+          applyEvent(event, data)
+        }
+      }
     } catch (err) {
       setError(err.message || 'An error occurred while processing the request')
     } finally {
@@ -21,12 +21,25 @@ const ResultsDisplay = ({ results }) => {
       <h2 className="results-title">Classification Results</h2>
 
       <div className="results-grid">
+        {results.connection_status && (
+          <div className="result-card">
+            <div className="card-header">
+              <h3>Connection Status</h3>
+            </div>
+            <div className="card-content">
+              <div className="connection-status">{results.connection_status}</div>
+            </div>
+          </div>
+        )}
+
         <div className="result-card primary">
           <div className="card-header">
             <h3>Disposition Code</h3>
           </div>
           <div className="card-content">
-            <div className="disposition-code">{results.Disposition_code}</div>
+            <div className="disposition-code">
+              {results.Disposition_code ?? <span className="pending">Classifying...</span>}
+            </div>
           </div>
         </div>
 
@@ -35,30 +48,36 @@ const ResultsDisplay = ({ results }) => {
             <h3>Confidence Score</h3>
           </div>
           <div className="card-content">
-            <div
-              className="confidence-badge"
-              style={{ backgroundColor: getConfidenceColor(results.confidence) }}
-            >
-              <span className="confidence-value">
-                {results.confidence >= 0
-                  ? (results.confidence * 100).toFixed(1)
-                  : 'N/A'}
-                %
-              </span>
-              <span className="confidence-label">
-                {getConfidenceLabel(results.confidence)}
-              </span>
-            </div>
+            {results.confidence === undefined ? (
+              <span className="pending">Waiting for disposition...</span>
+            ) : (
+              <div
+                className="confidence-badge"
+                style={{ backgroundColor: getConfidenceColor(results.confidence) }}
+              >
+                <span className="confidence-value">
+                  {results.confidence >= 0
+                    ? (results.confidence * 100).toFixed(1)
+                    : 'N/A'}
+                  %
+                </span>
+                <span className="confidence-label">
+                  {getConfidenceLabel(results.confidence)}
+                </span>
+              </div>
+            )}
           </div>
         </div>
       </div>
 
-      <div className="result-section">
-        <h3 className="section-title">Explanation</h3>
-        <div className="section-content explanation">
-          <p>{results.explanation}</p>
+      {results.explanation && (
+        <div className="result-section">
+          <h3 className="section-title">Explanation</h3>
+          <div className="section-content explanation">
+            <p>{results.explanation}</p>
+          </div>
         </div>
-      </div>
+      )}
 
       {results.summary && (
         <div className="result-section">
@@ -1,13 +1,17 @@
 import os
+import re
+import time
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent
 from langchain.agents.middleware.types import AgentMiddleware, ModelRequest, ModelResponse, ModelCallResult
 import loguru
-from preprocess_csv import get_disposition_data_grievance
+from preprocess_csv import get_tables, TableSnapshot
+from metrics import stage_timer, record_stage, GRIEVANCE_SPECULATION, GRIEVANCE_SPECULATION_SAVED_SECONDS
+from model_cascade import ModelCascade
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 
@@ -20,21 +24,17 @@ class GrievanceResult(BaseModel):
     key_points: List[str]
 
 
-# Grievance agent model is a model that classifies the grievance of the transcript
-model = ChatOpenAI(model=os.getenv("OPENAI_MODEL"), temperature=0.5)
+# Grievance cascade classifies the grievance of the transcript, escalating to a larger model tier when the answer's
+# confidence is below its code's threshold or the code is not in the grievance table
+agent = ModelCascade("grievance", GrievanceResult, temperature=0.5)
 
-# Grievance agent is a agent that classifies the grievance of the transcript
-agent = create_agent(
-    model=model,
-    tools=[],
-    response_format=GrievanceResult
-)
+# Allowed grievance codes are the table's subcategories plus the explicit "no grievance" answer
+def _allowed_grievance(tables: TableSnapshot):
+    return lambda code: code in tables.grievance_codes or code == "NO_GRIEVANCE"
 
-# Grievance data is a list of grievances
-grievance_data_formated, grievance_data = get_disposition_data_grievance()
-
-# Grievance agent system prompt is a prompt that classifies the grievance of the transcript
-system_prompt_grievance = f"""
+# Grievance agent system prompt is a prompt that classifies the grievance of the transcript, built once per table version
+def build_system_prompt_grievance(tables: TableSnapshot) -> str:
+    return f"""
 You are a Senior Grievance Subcategory Classifier for Loan Collections.
 
 Your SINGLE responsibility:
@@ -42,7 +42,7 @@ Given a call transcript summary, classify the grievance into the MOST RELEVANT s
 
 ---------------------------------------------
 GRIEVANCE SUBCATEGORY TABLE (Ground Truth)
-{grievance_data_formated}
+{tables.grievance_data_formated}
 ---------------------------------------------
 
 ## MANDATORY CLASSIFICATION RULES
@@ -87,12 +87,11 @@ GRIEVANCE SUBCATEGORY TABLE (Ground Truth)
 ---------------------------------------------
 """
 
-# Grievance agent is a agent that classifies the grievance of the transcript
-def get_grievance(summary: str) -> str:
-    # Grievance agent is a agent that classifies the grievance of the transcript
-        result_grievance = agent.invoke({
+# Grievance messages is a function that builds the grievance agent input from the summary
+def _grievance_messages(summary: str, tables: TableSnapshot):
+    return {
     "messages": [
-        {"role": "system", "content": system_prompt_grievance},
+        {"role": "system", "content": tables.prompt("grievance", build_system_prompt_grievance)},
         {
             "role": "user",
             "content": f"""
@@ -103,7 +102,93 @@ SUMMARY:
 """
         }
     ]
-})
-        result_grievance['structured_response'].Disposition_code = f"GRIEVANCE({result_grievance['structured_response'].Disposition_code})".replace("_", " ")
-        loguru.logger.info(f"Grievance Result: {result_grievance['structured_response'].Disposition_code}")
-        return result_grievance
\ No newline at end of file
+}
+
+# Format grievance is a function that rewrites the sub-category code into the GRIEVANCE(...) display form
+def _format_grievance(result_grievance):
+    result_grievance['structured_response'].Disposition_code = f"GRIEVANCE({result_grievance['structured_response'].Disposition_code})".replace("_", " ")
+    loguru.logger.info(f"Grievance Result: {result_grievance['structured_response'].Disposition_code}")
+    return result_grievance
+
+# Classify grievance is a function that runs the grievance agent without recording the stage
+async def _aclassify_grievance(summary: str, tables: TableSnapshot):
+    result_grievance = await agent.ainvoke(_grievance_messages(summary, tables), _allowed_grievance(tables))
+    return _format_grievance(result_grievance)
+
+# Async grievance agent is a agent that classifies the grievance of the transcript
+async def aget_grievance(summary: str, tables: Optional[TableSnapshot] = None) -> str:
+    with stage_timer("grievance"):
+        return await _aclassify_grievance(summary, tables or get_tables())
+
+# Speculative grievance classification starts the grievance agent alongside the classifier when the summary looks like
+# a complaint, instead of after it returns GRIEVANCE. The grievance agent only reads the summary, so the speculative
+# answer is the one the serial call would give; when the classifier does not say GRIEVANCE it is cancelled.
+GRIEVANCE_SPECULATION_ENABLED = os.getenv("GRIEVANCE_SPECULATION", "false").lower() in ("1", "true", "yes")
+# Complaint score at or above which the grievance call is started early: lower wastes more calls, higher saves less latency
+GRIEVANCE_SPECULATION_THRESHOLD = float(os.getenv("GRIEVANCE_SPECULATION_THRESHOLD", "0.5"))
+
+# Complaint keywords and their weight in the complaint score; prefixes, so "harass" also matches "harassment"
+COMPLAINT_KEYWORDS = {
+    1.0: ["complain", "grievance", "fraud", "harass", "dispute", "ombudsman", "shikayat", "dhokha", "शिकायत", "धोखा"],
+    0.5: [
+        "not taken", "never took", "never taken", "did not take", "cancelled", "canceled", "not received", "not credited",
+        "auto debit", "auto-debit", "nach", "ecs", "already paid", "paid but", "not updated", "not reflect",
+        "wrong emi", "wrong amount", "extra charge", "overcharg", "rude", "abusive", "misbehav", "threat", "escalat",
+    ],
+}
+_complaint_patterns = [
+    (re.compile(r"(?<!\w)(?:" + "|".join(re.escape(k) for k in keywords) + ")", re.IGNORECASE), weight)
+    for weight, keywords in COMPLAINT_KEYWORDS.items()
+]
+
+# Grievance score is a function that scores how much a summary reads like a complaint, from 0 to 1
+def grievance_score(summary: str) -> float:
+    score = 0.0
+    for pattern, weight in _complaint_patterns:
+        score += weight * len({match.lower() for match in pattern.findall(summary or "")})
+    return min(score, 1.0)
+
+# Grievance speculation is one grievance call started ahead of the classifier's answer. Its grievance stage time is
+# only recorded on a hit, so discarded calls do not show up as grievance latency in Server-Timing or the histogram.
+class GrievanceSpeculation:
+    def __init__(self, summary: str, tables: TableSnapshot):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.task = asyncio.create_task(_aclassify_grievance(summary, tables))
+        self.task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self.finished = time.perf_counter()
+        # Retrieve the outcome, so a discarded call that failed does not log "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    # Result is a method that returns the grievance answer when the classifier said GRIEVANCE (a hit). The latency
+    # saved is the time the call already ran alongside the classifier.
+    async def result(self):
+        GRIEVANCE_SPECULATION.labels(outcome="hit").inc()
+        GRIEVANCE_SPECULATION_SAVED_SECONDS.inc((self.finished or time.perf_counter()) - self.started)
+        try:
+            return await self.task
+        finally:
+            record_stage("grievance", (self.finished or time.perf_counter()) - self.started)
+
+    # Discard is a method that cancels the call when the classifier did not say GRIEVANCE (a wasted call)
+    def discard(self) -> None:
+        GRIEVANCE_SPECULATION.labels(outcome="wasted").inc()
+        self.cancel()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+# Speculate grievance is a function that starts a speculative grievance call when speculation is on and the summary
+# scores at or above the threshold; returns None otherwise
+def speculate_grievance(summary: str, tables: TableSnapshot) -> Optional[GrievanceSpeculation]:
+    if not GRIEVANCE_SPECULATION_ENABLED or grievance_score(summary) < GRIEVANCE_SPECULATION_THRESHOLD:
+        return None
+    return GrievanceSpeculation(summary, tables)
+
+# Record missed speculation is a function that counts a GRIEVANCE answer that was not speculated on
+def record_missed_speculation() -> None:
+    if GRIEVANCE_SPECULATION_ENABLED:
+        GRIEVANCE_SPECULATION.labels(outcome="missed").inc()
@@ -0,0 +1,351 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import loguru
+from T2T_agent import SPEAKERS, compact_turn, format_turn
+from connection_status import adetect_connection_status, CONNECTED
+from summary_agent import aupdate_summary
+from preprocess_csv import get_tables
+from result_cache import CACHE_USE
+from metrics import LIVE_CALLS, LIVE_EVENTS
+from Disposition_classifier_agnet import (
+    get_disposition, classify_summary, is_grievance, resolve_grievance, finalize_disposition, grievance_subcategory,
+    store_result, DispositionResult,
+)
+
+# Live disposition classifies a call while it is still in progress. The client sends turns over a WebSocket as they
+# are spoken; each call keeps its transcript, a rolling summary that is updated from the new turns only, and the last
+# provisional result. Re-classification is debounced, a provisional result is pushed when the code or confidence
+# changes, and the end of the call gets the full pipeline's authoritative result.
+
+# Seconds of quiet after a turn before re-classifying, and the longest a new turn waits while turns keep arriving
+LIVE_DEBOUNCE_SECONDS = float(os.getenv("LIVE_DEBOUNCE_SECONDS", "1.5"))
+LIVE_MAX_DELAY_SECONDS = float(os.getenv("LIVE_MAX_DELAY_SECONDS", "5"))
+# Confidence change that is pushed even when the code stays the same
+LIVE_CONFIDENCE_DELTA = float(os.getenv("LIVE_CONFIDENCE_DELTA", "0.05"))
+# Calls whose state is held at once; the least recently active disconnected call is evicted to make room
+LIVE_MAX_CALLS = int(os.getenv("LIVE_MAX_CALLS", "1000"))
+# Seconds without a turn after which a call's state is dropped (and a connected client is closed)
+LIVE_IDLE_SECONDS = float(os.getenv("LIVE_IDLE_SECONDS", "300"))
+# Seconds between sweeps for idle disconnected calls
+LIVE_SWEEP_SECONDS = float(os.getenv("LIVE_SWEEP_SECONDS", "30"))
+# Transcript characters held per call; beyond this the oldest turns already in the rolling summary are dropped,
+# and the final result is classified from the rolling summary instead of the full transcript
+LIVE_MAX_CHARS = int(os.getenv("LIVE_MAX_CHARS", "200000"))
+
+# Live call is the state of one call in progress
+class LiveCall:
+    def __init__(self, call_id: str):
+        self.call_id = call_id
+        self.started = time.perf_counter()
+        self.last_active = time.monotonic()
+        # Turns held (raw, for the connection status and the final pipeline) and their formatted text, preprocessed once
+        self.turns: List[Dict[str, Any]] = []
+        self.texts: List[str] = []
+        self.chars = 0
+        # Absolute turn numbers: turns dropped from the front, and turns already folded into the rolling summary
+        self.dropped = 0
+        self.folded = 0
+        self.pending_since: Optional[float] = None
+        self.last_turn_at = 0.0
+        self.summary = ""
+        self.connection_status: Optional[str] = None
+        self.provisional: Optional[DispositionResult] = None
+        self.websocket: Optional[WebSocket] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    @property
+    def turn_count(self) -> int:
+        return self.dropped + len(self.turns)
+
+    @property
+    def truncated(self) -> bool:
+        return self.dropped > 0
+
+    def add_turn(self, turn: Dict[str, Any]) -> None:
+        speaker = SPEAKERS.get(turn.get("role"))
+        content = compact_turn(turn.get("content") or "", speaker) if speaker is not None else ""
+        text = format_turn(speaker, content) if content else ""
+        self.turns.append(turn)
+        self.texts.append(text)
+        self.chars += len(turn.get("content") or "") + len(text)
+        now = time.monotonic()
+        self.last_active = self.last_turn_at = now
+        if self.pending_since is None:
+            self.pending_since = now
+        # Only turns already folded into the summary may go, so nothing is lost from it
+        while self.chars > LIVE_MAX_CHARS and self.dropped < self.folded:
+            dropped = self.turns.pop(0)
+            self.chars -= len(dropped.get("content") or "") + len(self.texts.pop(0))
+            if not self.truncated:
+                LIVE_EVENTS.labels(event="truncated").inc()
+            self.dropped += 1
+
+    # Pending text is a method that returns the formatted turns not yet in the rolling summary, and the turn count they end at
+    def pending_text(self):
+        end = self.turn_count
+        return "".join(self.texts[self.folded - self.dropped:]), end
+
+    def has_pending(self) -> bool:
+        return self.folded < self.turn_count
+
+    def message(self, kind: str, result: DispositionResult, **extra: Any) -> Dict[str, Any]:
+        return {
+            "type": kind,
+            "call_id": self.call_id,
+            **result.model_dump(),
+            "connection_status": self.connection_status,
+            "turns": self.turn_count,
+            "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            **extra,
+        }
+
+# Live call registry holds the state of calls in progress, least recently active first. Memory is bounded by
+# LIVE_MAX_CALLS calls of at most LIVE_MAX_CHARS each; calls idle for LIVE_IDLE_SECONDS are dropped by a background
+# sweep every LIVE_SWEEP_SECONDS (started with the app), and when a new call needs room.
+class LiveCallRegistry:
+    def __init__(self, max_calls: int = LIVE_MAX_CALLS, idle_seconds: float = LIVE_IDLE_SECONDS,
+                 sweep_seconds: float = LIVE_SWEEP_SECONDS):
+        self.max_calls = max_calls
+        self.idle_seconds = idle_seconds
+        self.sweep_seconds = sweep_seconds
+        self.calls: "OrderedDict[str, LiveCall]" = OrderedDict()
+        self.sweeper: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            await asyncio.gather(self.sweeper, return_exceptions=True)
+            self.sweeper = None
+
+    # Sweep is a method that expires idle calls periodically, so a disconnected call does not wait for the next one
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                self.expire()
+            except Exception:
+                loguru.logger.exception("Live call sweep failed")
+
+    # Expire is a method that drops calls nobody has sent a turn for in idle_seconds
+    def expire(self) -> None:
+        now = time.monotonic()
+        for call_id, call in list(self.calls.items()):
+            if now - call.last_active < self.idle_seconds:
+                break
+            # A connected client is closed by its own idle timeout
+            if call.websocket is not None:
+                continue
+            self.drop(call_id)
+            LIVE_EVENTS.labels(event="expired").inc()
+            loguru.logger.info(f"Live call {call_id} expired")
+
+    # Open is a method that returns the state for a call (resumed after a reconnect), creating it if needed;
+    # returns None when every slot is taken by a connected call
+    def open(self, call_id: str) -> Optional[LiveCall]:
+        self.expire()
+        call = self.calls.get(call_id)
+        if call is None:
+            if len(self.calls) >= self.max_calls and not self._evict():
+                LIVE_EVENTS.labels(event="rejected").inc()
+                return None
+            call = self.calls[call_id] = LiveCall(call_id)
+            LIVE_CALLS.set(len(self.calls))
+        self.touch(call)
+        return call
+
+    def _evict(self) -> bool:
+        for call_id, call in self.calls.items():
+            if call.websocket is None:
+                self.drop(call_id)
+                LIVE_EVENTS.labels(event="evicted").inc()
+                return True
+        return False
+
+    def touch(self, call: LiveCall) -> None:
+        call.last_active = time.monotonic()
+        self.calls.move_to_end(call.call_id)
+
+    def drop(self, call_id: str) -> None:
+        call = self.calls.pop(call_id, None)
+        if call is not None and call.worker is not None:
+            call.worker.cancel()
+        LIVE_CALLS.set(len(self.calls))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "calls": len(self.calls),
+            "connected": sum(1 for call in self.calls.values() if call.websocket is not None),
+            "max_calls": self.max_calls,
+        }
+
+live_calls = LiveCallRegistry()
+
+# Fold is a function that folds the call's pending turns into its rolling summary
+async def _fold(call: LiveCall) -> bool:
+    text, end = call.pending_text()
+    call.pending_since = None
+    if not text:
+        call.folded = end
+        return False
+    summary = await aupdate_summary(call.summary, text)
+    call.summary, call.folded = summary, end
+    return True
+
+# Live connection status is a function that checks the connection status until the call is known to be connected;
+# a connected call stays connected, so later re-classifications skip the check
+async def _live_status(call: LiveCall) -> str:
+    if call.connection_status != CONNECTED:
+        call.connection_status = await adetect_connection_status(call.turns)
+    return call.connection_status
+
+# Changed is a function that tells whether a provisional result differs enough from the last one to be pushed
+def _changed(previous: Optional[DispositionResult], result: DispositionResult) -> bool:
+    if previous is None or previous.Disposition_code != result.Disposition_code:
+        return True
+    return abs(previous.confidence - result.confidence) >= LIVE_CONFIDENCE_DELTA
+
+# Push is a function that sends a message to the call's client, if one is connected. It runs in the debounce
+# worker, which nobody awaits, so a socket that closed mid-send is logged instead of raised.
+async def _push(call: LiveCall, message: Dict[str, Any]) -> bool:
+    websocket = call.websocket
+    if websocket is None:
+        return False
+    try:
+        await websocket.send_json(message)
+    except Exception as e:
+        loguru.logger.info(f"Live call {call.call_id}: {message['type']} not sent, client gone: {e!r}")
+        return False
+    return True
+
+# Reclassify is a function that folds the new turns into the summary and classifies it, pushing the result if it changed
+async def _reclassify(call: LiveCall) -> None:
+    if not await _fold(call):
+        return
+    status = await _live_status(call)
+    result = finalize_disposition(await classify_summary(call.summary, status, get_tables()))
+    LIVE_EVENTS.labels(event="reclassified").inc()
+    if _changed(call.provisional, result):
+        call.provisional = result
+        if await _push(call, call.message("provisional", result)):
+            LIVE_EVENTS.labels(event="provisional").inc()
+
+# Debounce is a function that re-classifies a call once turns stop arriving for LIVE_DEBOUNCE_SECONDS, or at the latest
+# LIVE_MAX_DELAY_SECONDS after the first unprocessed turn, until no turns are pending
+async def _debounce(call: LiveCall) -> None:
+    while call.has_pending():
+        while True:
+            due = min(call.last_turn_at + LIVE_DEBOUNCE_SECONDS, (call.pending_since or call.last_turn_at) + LIVE_MAX_DELAY_SECONDS)
+            delay = due - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        try:
+            await _reclassify(call)
+        except Exception as e:
+            loguru.logger.exception(f"Live call {call.call_id} re-classification failed")
+            await _push(call, {"type": "error", "call_id": call.call_id, "detail": str(e)})
+            return
+
+# Schedule is a function that starts the call's debounce worker unless one is already waiting
+def _schedule(call: LiveCall) -> None:
+    if call.worker is None or call.worker.done():
+        call.worker = asyncio.create_task(_debounce(call))
+
+# Finalize is a function that computes the authoritative result at the end of the call: the full pipeline on the
+# whole transcript, or, when old turns were dropped to bound memory, the pipeline's classify and grievance steps
+# on the rolling summary
+async def _finalize(call: LiveCall) -> Dict[str, Any]:
+    if call.worker is not None:
+        call.worker.cancel()
+    if not call.truncated:
+        result = await get_disposition(call.turns, cache=CACHE_USE, mode=None)
+        return call.message("final", result, source="transcript")
+    tables = get_tables()
+    await _fold(call)
+    status = await _live_status(call)
+    result = await classify_summary(call.summary, status, tables)
+    grievance = is_grievance(result, status)
+    result = await resolve_grievance(result, call.summary, tables) if grievance else finalize_disposition(result)
+    await store_result(call.turns, result, "live_summary", tables, status, grievance_subcategory(result) if grievance else None)
+    return call.message("final", result, source="rolling_summary")
+
+# Turns is a function that reads the turns out of a client message: one turn, or {"turns": [...]}
+def _turns(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if isinstance(message.get("turns"), list):
+        return [turn for turn in message["turns"] if isinstance(turn, dict)]
+    return [{"role": message.get("role"), "content": message.get("content")}]
+
+router = APIRouter()
+
+# Live disposition endpoint accepts the turns of a call in progress. Client messages:
+#   {"type": "turn", "role": "user" | "assistant", "content": "..."}   (or {"type": "turn", "turns": [...]})
+#   {"type": "end"}                                                      the call ended; answered with the final result
+# Server messages: "session" (the call id), "provisional" results, "final", and "error".
+# Reconnecting with the same call_id resumes the call while its state has not expired.
+@router.websocket("/disposition/live")
+async def live_disposition(websocket: WebSocket, call_id: Optional[str] = None):
+    await websocket.accept()
+    call_id = call_id or uuid.uuid4().hex
+    call = live_calls.open(call_id)
+    if call is None:
+        await websocket.send_json({"type": "error", "call_id": call_id, "detail": "Too many live calls"})
+        await websocket.close(code=1013)
+        return
+    if call.websocket is not None:
+        await websocket.send_json({"type": "error", "call_id": call_id, "detail": "Call is already connected"})
+        await websocket.close(code=1008)
+        return
+    call.websocket = websocket
+    try:
+        await websocket.send_json({"type": "session", "call_id": call_id, "turns": call.turn_count})
+        if call.provisional is not None:
+            await websocket.send_json(call.message("provisional", call.provisional))
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive_json(), LIVE_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                live_calls.drop(call_id)
+                LIVE_EVENTS.labels(event="expired").inc()
+                await websocket.close(code=1000, reason="idle")
+                return
+            except ValueError:
+                await websocket.send_json({"type": "error", "call_id": call_id, "detail": "Messages must be JSON"})
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "turn":
+                for turn in _turns(message):
+                    call.add_turn(turn)
+                live_calls.touch(call)
+                _schedule(call)
+            elif kind == "end":
+                live_calls.drop(call_id)
+                try:
+                    final = await _finalize(call)
+                except Exception as e:
+                    loguru.logger.exception(f"Live call {call_id} final disposition failed")
+                    await websocket.send_json({"type": "error", "call_id": call_id, "detail": str(e)})
+                else:
+                    LIVE_EVENTS.labels(event="final").inc()
+                    await websocket.send_json(final)
+                await websocket.close()
+                return
+            else:
+                await websocket.send_json({"type": "error", "call_id": call_id, "detail": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        loguru.logger.info(f"Live call {call_id} disconnected with {call.turn_count} turns; state kept until idle")
+    finally:
+        call.websocket = None
+
+# Live stats endpoint reports the calls currently held
+@router.get("/disposition/live/stats")
+async def get_live_stats() -> Dict[str, Any]:
+    return live_calls.get_stats()
@@ -0,0 +1,538 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, Optional
+from dotenv import load_dotenv
+load_dotenv()
+import httpx
+from fastapi import APIRouter
+from langchain_openai import ChatOpenAI
+import loguru
+from T2T_agent import count_tokens
+from metrics import (
+    LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS, LLM_IN_FLIGHT, LLM_CONCURRENCY_LIMIT,
+    LLM_GATEWAY_RETRIES, LLM_GATEWAY_SHED, LLM_RATE_LIMIT_REMAINING,
+)
+
+# LLM gateway is the one admission point for every model call in the process. Each ChatOpenAI is built with
+# chat_model(), whose HTTP clients send through the gateway: a call waits in a bounded FIFO queue for a concurrency
+# slot, then for room in the requests-per-minute and tokens-per-minute buckets, and is retried with jittered backoff
+# on 429/5xx. The concurrency limit adapts to the x-ratelimit-* headers the API returns (AIMD). When the queue is full
+# the call is refused with GatewayOverloaded, which main.py turns into a 503 with Retry-After.
+
+# Budgets per minute; 0 means no budget configured, in which case the limits the API reports in its headers are used
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# Concurrency range the adaptive limit moves in; it starts at the maximum
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "2"))
+# Calls allowed to wait for a slot, and seconds one may wait, before calls are shed
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "256"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Retries on 429, 5xx and connection errors, with full-jitter exponential backoff between base and max seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Completion tokens reserved per call when the request does not set max_tokens
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "400"))
+# The limit backs off when less than this fraction of the API's request or token budget remains
+LLM_HEADROOM = float(os.getenv("LLM_HEADROOM", "0.1"))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Gateway overloaded is raised when a call is shed; retry_after is the suggested wait in seconds
+class GatewayOverloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM gateway overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+# Overload cause is a function that finds a GatewayOverloaded behind an exception (the OpenAI client wraps
+# transport errors in APIConnectionError)
+def overload_cause(error: BaseException) -> Optional[GatewayOverloaded]:
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, GatewayOverloaded):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+# Token bucket refills at limit/60 per second up to limit. Reservations may take it below zero; the caller then
+# waits until the debt is paid back, which keeps the long-run rate at the budget without busy polling.
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.configured = per_minute
+        # Processes sharing the API budget (see LLMGateway.split); reported limits are divided between them
+        self.share = 1
+        self.limit = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    # Reserve is a method that takes amount from the bucket and returns the seconds to wait before using it
+    def reserve(self, amount: float, now: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level * 60 / self.limit)
+
+    # Wait for is a method that returns the seconds until amount would be available, without reserving it
+    def wait_for(self, amount: float, now: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (amount - self.level) * 60 / self.limit)
+
+    # Observe is a method that aligns the bucket with the limit and remaining budget the API reported.
+    # A configured budget is kept when it is lower than the API's.
+    def observe(self, limit: Optional[int], remaining: Optional[int], now: float) -> None:
+        if limit:
+            limit = max(1, limit // self.share)
+        if remaining is not None:
+            remaining //= self.share
+        if limit and (not self.configured or limit < self.configured) and limit != self.limit:
+            if not self.enabled:
+                self.level = float(limit)
+            self.limit = limit
+        if remaining is not None and self.enabled:
+            self._refill(now)
+            self.level = min(self.level, float(remaining))
+
+    # Drain is a method that empties the bucket (after a 429 the API has no budget left for us)
+    def drain(self, now: float) -> None:
+        if self.enabled:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+# Waiter is one call queued for a concurrency slot, woken through its event loop or a thread event
+class _Waiter:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop]):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+# Header int is a function that reads an integer response header, ignoring missing or malformed values
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+# Retry after is a function that reads the seconds the API asked us to wait (retry-after-ms or retry-after)
+def _retry_after(headers: httpx.Headers) -> Optional[float]:
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+# Estimate tokens is a function that estimates the tokens a chat completions request will use: the prompt text
+# plus the completion it may generate
+def estimate_tokens(body: bytes) -> int:
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return LLM_COMPLETION_TOKENS
+    prompt = 0
+    for message in payload.get("messages") or []:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        # A few tokens of framing per message
+        prompt += count_tokens(content) + 4
+    if payload.get("response_format") or payload.get("tools"):
+        prompt += count_tokens(json.dumps(payload.get("response_format") or payload.get("tools")))
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or LLM_COMPLETION_TOKENS
+    return prompt + completion
+
+# LLM gateway holds the process-wide queue, budgets and adaptive concurrency limit
+class LLMGateway:
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 min_concurrency: int = LLM_MIN_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._decreased_at = 0.0
+        # Moving averages of call latency and size, for the Retry-After estimate
+        self._latency = 1.0
+        self._call_tokens = float(LLM_COMPLETION_TOKENS)
+        self.stats = Counter()
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+
+    # Split is a method that gives this process 1/parts of the budgets and concurrency, for worker pools
+    # where each process has its own gateway (bulk_disposition.py)
+    def split(self, parts: int) -> None:
+        if parts <= 1:
+            return
+        with self._lock:
+            for bucket in (self.requests, self.tokens):
+                bucket.share = parts
+                bucket.configured = bucket.limit = bucket.configured // parts
+                bucket.level = min(bucket.level, float(bucket.limit))
+            self.max_concurrency = max(1, self.max_concurrency // parts)
+            self.min_concurrency = min(self.min_concurrency, self.max_concurrency)
+            self.max_queue = max(1, self.max_queue // parts)
+            self.limit = float(self.max_concurrency)
+
+    def _slots(self) -> int:
+        return max(1, int(self.limit))
+
+    def _publish(self) -> None:
+        LLM_QUEUE_DEPTH.set(len(self._waiters))
+        LLM_IN_FLIGHT.set(self.in_flight)
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+
+    # Retry after hint is a method that estimates when a shed caller could get through: the time to work off the queue
+    # at the current limit, or to refill the budgets for one more call, whichever is longer
+    def _retry_after_hint(self) -> int:
+        now = time.monotonic()
+        queue = (len(self._waiters) + 1) * self._latency / self._slots()
+        budget = max(self.requests.wait_for(1, now), self.tokens.wait_for(self._call_tokens, now))
+        return int(min(60, max(1, math.ceil(max(queue, budget)))))
+
+    # Overloaded is a method that returns the Retry-After seconds when new calls would be shed right now, else None.
+    # Endpoints check it before starting work, so a request is refused up front rather than partway through.
+    def overloaded(self) -> Optional[int]:
+        with self._lock:
+            if len(self._waiters) >= self.max_queue:
+                return self._retry_after_hint()
+        return None
+
+    def _shed(self, reason: str) -> GatewayOverloaded:
+        self.stats[f"shed_{reason}"] += 1
+        LLM_GATEWAY_SHED.labels(reason=reason).inc()
+        return GatewayOverloaded(reason, self._retry_after_hint())
+
+    # Enqueue is a method that takes a free slot, or queues a waiter; returns None when the slot was taken directly
+    def _enqueue(self, loop: Optional[asyncio.AbstractEventLoop]) -> Optional[_Waiter]:
+        with self._lock:
+            if not self._waiters and self.in_flight < self._slots():
+                self.in_flight += 1
+                self._publish()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._shed("queue_full")
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            self._publish()
+            return waiter
+
+    # Abandon is a method that takes a timed-out or cancelled waiter off the queue; returns whether it held a slot
+    def _abandon(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self._publish()
+            return False
+
+    # Grant is a method that hands free slots to queued waiters, in arrival order
+    def _grant(self) -> None:
+        woken = []
+        with self._lock:
+            while self._waiters and self.in_flight < self._slots():
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self.in_flight += 1
+                woken.append(waiter)
+            self._publish()
+        for waiter in woken:
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # Its event loop is closed; nobody will use the slot
+                self.release()
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._grant()
+
+    # Acquire is a method that waits for a concurrency slot (queue wait)
+    async def acquire(self) -> None:
+        start = time.perf_counter()
+        waiter = self._enqueue(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    self.release()
+                raise self._shed("queue_timeout")
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self.release()
+                raise
+        LLM_QUEUE_WAIT_SECONDS.labels(wait="queue").observe(time.perf_counter() - start)
+
+    # Acquire sync is the blocking variant of acquire, for the sync model calls
+    def acquire_sync(self) -> None:
+        start = time.perf_counter()
+        waiter = self._enqueue(None)
+        if waiter is not None and not waiter.event.wait(self.queue_timeout):
+            if self._abandon(waiter):
+                self.release()
+            raise self._shed("queue_timeout")
+        LLM_QUEUE_WAIT_SECONDS.labels(wait="queue").observe(time.perf_counter() - start)
+
+    # Reserve is a method that takes one request and the estimated tokens from the budgets; returns the seconds
+    # to wait before sending (budget wait)
+    def reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.stats["requests"] += 1
+            self._call_tokens = 0.9 * self._call_tokens + 0.1 * tokens
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+        LLM_QUEUE_WAIT_SECONDS.labels(wait="budget").observe(wait)
+        return wait
+
+    # Observe is a method that updates budgets and the concurrency limit from one API response: multiplicative
+    # decrease on 429 or when the reported budget runs low, additive increase (one slot per limit calls) otherwise
+    def observe(self, status: int, headers: httpx.Headers, latency: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if latency is not None:
+                self._latency = 0.9 * self._latency + 0.1 * latency
+            remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+            remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+            limit_requests = _header_int(headers, "x-ratelimit-limit-requests")
+            limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens")
+            self.requests.observe(limit_requests, remaining_requests, now)
+            self.tokens.observe(limit_tokens, remaining_tokens, now)
+            if remaining_requests is not None:
+                LLM_RATE_LIMIT_REMAINING.labels(kind="requests").set(remaining_requests)
+            if remaining_tokens is not None:
+                LLM_RATE_LIMIT_REMAINING.labels(kind="tokens").set(remaining_tokens)
+            fractions = [
+                remaining / limit for remaining, limit in ((remaining_requests, limit_requests), (remaining_tokens, limit_tokens))
+                if remaining is not None and limit
+            ]
+            if status == 429 or (fractions and min(fractions) < LLM_HEADROOM):
+                if status == 429:
+                    self.requests.drain(now)
+                    self.tokens.drain(now)
+                # One decrease per latency period, so a burst of 429s from the same moment counts once
+                if now - self._decreased_at >= self._latency and self.limit > self.min_concurrency:
+                    self._decreased_at = now
+                    self.limit = max(self.min_concurrency, self.limit * (0.5 if status == 429 else 0.75))
+                    self.stats["decreased"] += 1
+                    loguru.logger.warning(f"LLM gateway concurrency limit lowered to {int(self.limit)} (status {status})")
+            elif status < 400 and self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._publish()
+        # A raised limit may free slots for queued calls
+        self._grant()
+
+    # Backoff is a method that returns the seconds to wait before retry number attempt (full jitter), at least as long
+    # as the API asked for
+    def backoff(self, attempt: int, headers: Optional[httpx.Headers] = None) -> float:
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+        requested = _retry_after(headers) if headers is not None else None
+        if requested is not None:
+            delay = max(delay, min(requested, LLM_BACKOFF_MAX))
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "concurrency_limit": round(self.limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "rpm_limit": self.requests.limit or None,
+                "tpm_limit": self.tokens.limit or None,
+                "requests": self.stats["requests"],
+                "retries": self.stats["retries"],
+                "shed_queue_full": self.stats["shed_queue_full"],
+                "shed_queue_timeout": self.stats["shed_queue_timeout"],
+                "limit_decreases": self.stats["decreased"],
+            }
+
+# Should retry is a function that decides whether a response is retried; the API's x-should-retry header wins
+def _should_retry(response: httpx.Response) -> bool:
+    should = response.headers.get("x-should-retry")
+    if should in ("true", "false"):
+        return should == "true"
+    return response.status_code in RETRY_STATUSES
+
+# Releasing streams hand the slot back when the response body is closed, so a streamed completion holds its slot
+# until the last token
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+class _ReleasingSyncStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+# Once is a function that wraps release so closing a response more than once frees one slot
+def _once(release: Callable[[], None]) -> Callable[[], None]:
+    done = []
+    def run() -> None:
+        if not done:
+            done.append(True)
+            release()
+    return run
+
+# Gateway transport sends async model calls through the gateway: queue, budgets, retries
+class GatewayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, gateway: LLMGateway, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.gateway = gateway
+        self.transport = transport or httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        gateway = self.gateway
+        tokens = estimate_tokens(await request.aread())
+        await gateway.acquire()
+        release = _once(gateway.release)
+        try:
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                wait = gateway.reserve(tokens)
+                if wait:
+                    await asyncio.sleep(wait)
+                start = time.perf_counter()
+                try:
+                    response = await self.transport.handle_async_request(request)
+                except httpx.TransportError as e:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    LLM_GATEWAY_RETRIES.labels(reason="connection").inc()
+                    gateway.stats["retries"] += 1
+                    loguru.logger.warning(f"LLM call failed ({e!r}), retry {attempt + 1}/{LLM_MAX_RETRIES}")
+                    await asyncio.sleep(gateway.backoff(attempt))
+                    continue
+                gateway.observe(response.status_code, response.headers, time.perf_counter() - start)
+                if attempt < LLM_MAX_RETRIES and _should_retry(response):
+                    await response.aclose()
+                    LLM_GATEWAY_RETRIES.labels(reason=str(response.status_code)).inc()
+                    gateway.stats["retries"] += 1
+                    delay = gateway.backoff(attempt, response.headers)
+                    loguru.logger.warning(f"LLM call returned {response.status_code}, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                return httpx.Response(
+                    status_code=response.status_code, headers=response.headers,
+                    stream=_ReleasingStream(response.stream, release), extensions=response.extensions, request=request,
+                )
+        except BaseException:
+            release()
+            raise
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+# Sync gateway transport is the blocking variant of GatewayTransport
+class SyncGatewayTransport(httpx.BaseTransport):
+    def __init__(self, gateway: LLMGateway, transport: Optional[httpx.BaseTransport] = None):
+        self.gateway = gateway
+        self.transport = transport or httpx.HTTPTransport(limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100))
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        gateway = self.gateway
+        tokens = estimate_tokens(request.read())
+        gateway.acquire_sync()
+        release = _once(gateway.release)
+        try:
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                wait = gateway.reserve(tokens)
+                if wait:
+                    time.sleep(wait)
+                start = time.perf_counter()
+                try:
+                    response = self.transport.handle_request(request)
+                except httpx.TransportError as e:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                    LLM_GATEWAY_RETRIES.labels(reason="connection").inc()
+                    gateway.stats["retries"] += 1
+                    loguru.logger.warning(f"LLM call failed ({e!r}), retry {attempt + 1}/{LLM_MAX_RETRIES}")
+                    time.sleep(gateway.backoff(attempt))
+                    continue
+                gateway.observe(response.status_code, response.headers, time.perf_counter() - start)
+                if attempt < LLM_MAX_RETRIES and _should_retry(response):
+                    response.close()
+                    LLM_GATEWAY_RETRIES.labels(reason=str(response.status_code)).inc()
+                    gateway.stats["retries"] += 1
+                    delay = gateway.backoff(attempt, response.headers)
+                    loguru.logger.warning(f"LLM call returned {response.status_code}, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                    time.sleep(delay)
+                    continue
+                return httpx.Response(
+                    status_code=response.status_code, headers=response.headers,
+                    stream=_ReleasingSyncStream(response.stream, release), extensions=response.extensions, request=request,
+                )
+        except BaseException:
+            release()
+            raise
+
+    def close(self) -> None:
+        self.transport.close()
+
+# Gateway for this process, and the HTTP clients every chat model shares
+gateway = LLMGateway()
+http_client = httpx.Client(transport=SyncGatewayTransport(gateway))
+http_async_client = httpx.AsyncClient(transport=GatewayTransport(gateway))
+
+# Chat model is a function that builds a ChatOpenAI whose calls go through the gateway. The OpenAI client's own
+# retries are turned off; the gateway retries instead, inside its budgets.
+def chat_model(**kwargs: Any) -> ChatOpenAI:
+    return ChatOpenAI(http_client=http_client, http_async_client=http_async_client, max_retries=0, **kwargs)
+
+# LLM gateway router exposes the gateway's queue, limit and budget state
+router = APIRouter()
+
+@router.get("/disposition/gateway/stats")
+async def get_gateway_stats() -> Dict[str, Any]:
+    return gateway.get_stats()
@@ -1,10 +1,50 @@
-from fastapi import FastAPI
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from openai import APIConnectionError
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from Disposition_classifier_agnet import router
+from batch_disposition import router as batch_router
+from stream_disposition import router as stream_router
+from live_disposition import router as live_router, live_calls
+from result_store import router as results_router, result_store, RESULT_STORE_ENABLED
+from llm_gateway import router as gateway_router, gateway, overload_cause, GatewayOverloaded
+from metrics import REQUEST_SECONDS, request_timings, server_timing
+from T2T_agent import load_token_encoding
+
+# Server-Timing header with per-stage durations on /disposition responses (SERVER_TIMING=false turns it off)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() not in ("0", "false", "no")
+
+# Endpoints that make model calls; they are refused up front while the LLM gateway queue is full
+LLM_PATHS = ("/disposition", "/disposition/stream", "/disposition/batch")
+
+# Lifespan loads the token encoding, starts the result store writer and the live call sweep and, on shutdown, writes whatever results are
+# still queued
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Loaded in a thread: the first load may download the encoding
+    await asyncio.to_thread(load_token_encoding)
+    if RESULT_STORE_ENABLED:
+        await result_store.start()
+    await live_calls.start()
+    try:
+        yield
+    finally:
+        await live_calls.stop()
+        await result_store.stop()
 
 # Create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
+app.include_router(batch_router)
+app.include_router(stream_router)
+app.include_router(live_router)
+app.include_router(results_router)
+app.include_router(gateway_router)
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,12 +53,63 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Timing middleware records request latency and collects per-stage timings for the Server-Timing header
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    total = time.perf_counter() - start
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(path=getattr(route, "path", "unmatched")).observe(total)
+    if SERVER_TIMING and timings:
+        response.headers["Server-Timing"] = server_timing(timings, total * 1000)
+    return response
+
+# Overloaded is a function that builds the 503 returned when the LLM gateway sheds a request
+def _overloaded(error: GatewayOverloaded) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(error)}, headers={"Retry-After": str(error.retry_after)})
+
+# Load shedding middleware refuses model-backed requests while the gateway queue is full, before any work is done
+@app.middleware("http")
+async def load_shedding_middleware(request: Request, call_next):
+    if request.url.path in LLM_PATHS:
+        retry_after = gateway.overloaded()
+        if retry_after is not None:
+            return _overloaded(GatewayOverloaded("queue_full", retry_after))
+    return await call_next(request)
+
+# Overload handlers turn a call shed mid-request (queue full or queue timeout) into a 503 with Retry-After.
+# Older OpenAI clients wrap transport errors in APIConnectionError, so the shed error may be its cause.
+@app.exception_handler(GatewayOverloaded)
+async def overload_handler(request: Request, error: GatewayOverloaded):
+    return _overloaded(error)
+
+@app.exception_handler(APIConnectionError)
+async def connection_error_handler(request: Request, error: APIConnectionError):
+    overloaded = overload_cause(error)
+    if overloaded is None:
+        raise error
+    return _overloaded(overloaded)
+
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the Disposition Classifier API"}
 
+# Metrics endpoint exposes the Prometheus histograms and counters
+@app.get("/metrics")
+async def get_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
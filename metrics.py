@@ -0,0 +1,154 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Metrics for the disposition pipeline, exposed by main.py on /metrics
+
+# Latency buckets (seconds) sized for LLM round trips
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "disposition_stage_seconds", "Wall time per pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "disposition_request_seconds", "Wall time per HTTP request", ["path"], buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_RESULT_SECONDS = Histogram(
+    "disposition_time_to_first_result_seconds", "Time until the first streamed stage result", buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter("disposition_llm_tokens", "LLM tokens per stage", ["stage", "model", "kind"])
+LLM_COST = Counter("disposition_llm_cost_usd", "Estimated LLM cost per stage in USD", ["stage", "model"])
+LLM_CALLS = Counter("disposition_llm_calls", "LLM calls per stage", ["stage", "model"])
+CASCADE_CALLS = Counter(
+    "disposition_cascade_calls", "Model cascade answers per tier (accepted, escalated, or kept on the top tier as low_confidence/unknown_code)",
+    ["stage", "model", "outcome"]
+)
+CASCADE_SAVED_COST = Gauge("disposition_cascade_saved_cost_usd", "Estimated cost saved by the cascade vs. always using the top tier", ["stage"])
+CASCADE_SAVED_SECONDS = Gauge("disposition_cascade_saved_seconds", "Estimated latency saved by the cascade vs. always using the top tier", ["stage"])
+GRIEVANCE_SPECULATION = Counter(
+    "disposition_grievance_speculation", "Speculative grievance calls (hit: used, wasted: cancelled, missed: GRIEVANCE without speculation)", ["outcome"]
+)
+GRIEVANCE_SPECULATION_SAVED_SECONDS = Counter(
+    "disposition_grievance_speculation_saved_seconds", "Grievance call time overlapped with the classifier by speculation"
+)
+COALESCED = Counter("disposition_coalesced", "Calls that waited on an identical in-flight execution", ["stage"])
+LLM_QUEUE_DEPTH = Gauge("disposition_llm_queue_depth", "Model calls waiting in the LLM gateway queue for a concurrency slot")
+LLM_IN_FLIGHT = Gauge("disposition_llm_in_flight", "Model calls holding an LLM gateway concurrency slot")
+LLM_CONCURRENCY_LIMIT = Gauge("disposition_llm_concurrency_limit", "Adaptive LLM gateway concurrency limit")
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "disposition_llm_queue_wait_seconds", "Time a model call waited in the LLM gateway (queue: for a slot, budget: for RPM/TPM room)",
+    ["wait"], buckets=LATENCY_BUCKETS
+)
+LLM_GATEWAY_RETRIES = Counter("disposition_llm_retries", "Model calls retried by the LLM gateway, by status code or connection", ["reason"])
+LLM_GATEWAY_SHED = Counter("disposition_llm_shed", "Model calls refused by the LLM gateway (queue_full, queue_timeout)", ["reason"])
+LLM_RATE_LIMIT_REMAINING = Gauge("disposition_llm_rate_limit_remaining", "Remaining API budget from the last x-ratelimit-* headers", ["kind"])
+LIVE_CALLS = Gauge("disposition_live_calls", "Live calls with state held for /disposition/live")
+LIVE_EVENTS = Counter(
+    "disposition_live_events", "Live call events (reclassified, provisional, final, expired, evicted, rejected, truncated)", ["event"]
+)
+RESULT_QUEUE_DEPTH = Gauge("disposition_result_queue_depth", "Results waiting to be written to the result database")
+RESULT_STORE_EVENTS = Counter(
+    "disposition_result_store_events", "Result store events (enqueued, persisted, dropped, failed)", ["event"]
+)
+RESULT_FLUSH_SECONDS = Histogram(
+    "disposition_result_flush_seconds", "Wall time per batched result database write", buckets=LATENCY_BUCKETS
+)
+
+# Model prices in USD per 1M (input, output) tokens; LLM_PRICE_INPUT_PER_1M / LLM_PRICE_OUTPUT_PER_1M override them
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+# Request timings collect per-stage milliseconds for the current request (used for the Server-Timing header)
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+# Model price is a function that returns the (input, output) price per 1M tokens for a model
+def model_price(model: str) -> Tuple[float, float]:
+    if os.getenv("LLM_PRICE_INPUT_PER_1M") and os.getenv("LLM_PRICE_OUTPUT_PER_1M"):
+        return float(os.getenv("LLM_PRICE_INPUT_PER_1M")), float(os.getenv("LLM_PRICE_OUTPUT_PER_1M"))
+    # Longest prefix wins so dated snapshots ("gpt-4o-mini-2024-07-18") use their family price
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return 0.0, 0.0
+
+# Record stage is a function that records a stage's wall time in the histogram and the request timings
+def record_stage(stage: str, elapsed: float) -> None:
+    STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+# Stage timer is a context manager that records a stage's wall time in the histogram and the request timings
+@contextmanager
+def stage_timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+# Record usage is a function that adds token counts and estimated cost from LLM response messages
+def record_usage(stage: str, messages: Any) -> None:
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    for message in messages:
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            continue
+        model = (getattr(message, "response_metadata", None) or {}).get("model_name") or os.getenv("OPENAI_MODEL") or "unknown"
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        input_price, output_price = model_price(model)
+        LLM_CALLS.labels(stage=stage, model=model).inc()
+        LLM_TOKENS.labels(stage=stage, model=model, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(stage=stage, model=model, kind="completion").inc(completion_tokens)
+        LLM_COST.labels(stage=stage, model=model).inc((prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000)
+
+# Server timing is a function that formats request timings as a Server-Timing header value
+def server_timing(timings: Dict[str, float], total_ms: float) -> str:
+    parts = [f"{stage};dur={ms:.1f}" for stage, ms in timings.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+# Counter sources are read at scrape time, so caches and fast paths keep their own counters
+_caches: List[Any] = []
+_fast_paths: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+# Register cache is a function that exposes a ResultCache's hit/miss/eviction counters
+def register_cache(cache: Any) -> None:
+    _caches.append(cache)
+
+# Register fast path is a function that exposes a component's decision path counters
+def register_fast_path(component: str, counts: Callable[[], Dict[str, int]]) -> None:
+    _fast_paths[component] = counts
+
+# Counter source collector turns the registered counters into Prometheus metric families
+class _CounterSourceCollector:
+    def collect(self) -> Iterable[Any]:
+        events = CounterMetricFamily("disposition_cache_events", "Result cache events", labels=["cache", "event"])
+        entries = GaugeMetricFamily("disposition_cache_memory_entries", "Entries in the memory cache tier", labels=["cache"])
+        for cache in _caches:
+            stats = cache.get_stats()
+            entries.add_metric([cache.name], stats.pop("memory_entries", 0))
+            for event, value in stats.items():
+                events.add_metric([cache.name, event], value)
+        paths = CounterMetricFamily("disposition_fast_path", "Decision path counts", labels=["component", "path"])
+        for component, counts in _fast_paths.items():
+            for path, value in counts().items():
+                paths.add_metric([component, path], value)
+        yield events
+        yield entries
+        yield paths
+
+REGISTRY.register(_CounterSourceCollector())
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from dotenv import load_dotenv
+load_dotenv()
+from llm_gateway import chat_model
+from langchain.agents import create_agent
+from pydantic import BaseModel
+import loguru
+from metrics import model_price, record_usage, CASCADE_CALLS, CASCADE_SAVED_COST, CASCADE_SAVED_SECONDS
+
+# Model cascade runs a structured-output agent on the cheapest model tier first and re-runs it on the next tier only
+# when the answer is not good enough: confidence below the code's threshold, or a code outside the allowed table.
+
+# Model tiers, cheapest first (e.g. CASCADE_MODELS=gpt-4o-mini,gpt-4o). One tier (the default) means no cascade.
+CASCADE_MODELS = [m.strip() for m in os.getenv("CASCADE_MODELS", os.getenv("OPENAI_MODEL") or "").split(",") if m.strip()]
+# Answers below this confidence are escalated; CASCADE_CODE_THRESHOLDS overrides it per code, as JSON {"CODE": 0.9}
+CASCADE_CONFIDENCE_THRESHOLD = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", "0.75"))
+CASCADE_CODE_THRESHOLDS: Dict[str, float] = json.loads(os.getenv("CASCADE_CODE_THRESHOLDS") or "{}")
+
+# Cascade signature identifies the tier and threshold settings, so cached results are not reused across them
+CASCADE_SIGNATURE = json.dumps([CASCADE_MODELS, CASCADE_CONFIDENCE_THRESHOLD, CASCADE_CODE_THRESHOLDS], sort_keys=True)
+
+# Code threshold is a function that returns the confidence an answer with this code needs to be accepted
+def code_threshold(code: str) -> float:
+    return CASCADE_CODE_THRESHOLDS.get(code, CASCADE_CONFIDENCE_THRESHOLD)
+
+# Usage tokens is a function that sums (prompt, completion) tokens over the response messages
+def _usage_tokens(messages: List[Any]) -> Tuple[int, int]:
+    prompt = completion = 0
+    for message in messages:
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt += usage.get("input_tokens", 0)
+        completion += usage.get("output_tokens", 0)
+    return prompt, completion
+
+# Cost is a function that prices token counts at a model's rates
+def _cost(model: str, prompt: int, completion: int) -> float:
+    input_price, output_price = model_price(model)
+    return (prompt * input_price + completion * output_price) / 1_000_000
+
+# Model cascade holds one agent per tier for a stage
+class ModelCascade:
+    def __init__(self, stage: str, response_format: Type[BaseModel], temperature: float, models: List[str] = CASCADE_MODELS):
+        self.stage = stage
+        self.models = models
+        self.agents = [
+            create_agent(model=chat_model(model=name, temperature=temperature), tools=[], response_format=response_format)
+            for name in models
+        ]
+        # Moving average latency of the top tier, the baseline for the latency saved by answering on a cheaper tier
+        self._top_latency: Optional[float] = None
+
+    # Review is a method that decides whether a tier's answer is kept; returns the escalation reason or None
+    def _review(self, response: BaseModel, allowed_codes: Optional[Callable[[str], bool]]) -> Optional[str]:
+        code = response.Disposition_code
+        if allowed_codes is not None and not allowed_codes(code):
+            return "unknown_code"
+        if response.confidence < code_threshold(code):
+            return "low_confidence"
+        return None
+
+    # Account is a method that records what answering on this tier saved against always calling the top tier.
+    # The top tier's cost is estimated from the accepted call's token counts and its latency from a moving average;
+    # escalated calls paid for the cheaper tiers as well, so they count as negative savings.
+    def _account(self, spent_cost: float, spent_seconds: float, prompt: int, completion: int) -> None:
+        if len(self.models) < 2:
+            return
+        CASCADE_SAVED_COST.labels(stage=self.stage).inc(_cost(self.models[-1], prompt, completion) - spent_cost)
+        if self._top_latency is not None:
+            CASCADE_SAVED_SECONDS.labels(stage=self.stage).inc(self._top_latency - spent_seconds)
+
+    # Run is a generator driving the tiers: it yields each tier's agent and is sent back that agent's output,
+    # so the sync and async invoke share the escalation logic
+    def _run(self, allowed_codes: Optional[Callable[[str], bool]]):
+        spent_cost = spent_seconds = 0.0
+        top = len(self.agents) - 1
+        for tier, agent in enumerate(self.agents):
+            start = time.perf_counter()
+            result = yield agent
+            elapsed = time.perf_counter() - start
+            record_usage(self.stage, result['messages'])
+            prompt, completion = _usage_tokens(result['messages'])
+            spent_cost += _cost(self.models[tier], prompt, completion)
+            spent_seconds += elapsed
+            if tier == top:
+                self._top_latency = elapsed if self._top_latency is None else 0.9 * self._top_latency + 0.1 * elapsed
+            reason = self._review(result['structured_response'], allowed_codes)
+            if reason is None or tier == top:
+                CASCADE_CALLS.labels(stage=self.stage, model=self.models[tier], outcome=reason or "accepted").inc()
+                self._account(spent_cost, spent_seconds, prompt, completion)
+                result['model_tier'] = self.models[tier]
+                return result
+            CASCADE_CALLS.labels(stage=self.stage, model=self.models[tier], outcome="escalated").inc()
+            loguru.logger.info(
+                f"{self.stage}: escalating {result['structured_response'].Disposition_code} "
+                f"({result['structured_response'].confidence}) from {self.models[tier]}: {reason}"
+            )
+
+    # Invoke is a method that runs the agent tiers until one answer is accepted (usage is recorded per tier);
+    # the result carries the answering model in result['model_tier']
+    def invoke(self, messages: Dict[str, Any], allowed_codes: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        run = self._run(allowed_codes)
+        agent = next(run)
+        while True:
+            try:
+                agent = run.send(agent.invoke(messages))
+            except StopIteration as done:
+                return done.value
+
+    # Async invoke is the non-blocking variant of invoke
+    async def ainvoke(self, messages: Dict[str, Any], allowed_codes: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        run = self._run(allowed_codes)
+        agent = next(run)
+        while True:
+            try:
+                agent = run.send(await agent.ainvoke(messages))
+            except StopIteration as done:
+                return done.value
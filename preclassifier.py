@@ -0,0 +1,513 @@
+import os
+import re
+import json
+import time
+import zlib
+import random
+import asyncio
+import hashlib
+import argparse
+import shutil
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from pydantic import BaseModel
+import loguru
+from T2T_agent import compact_turns, format_turn
+from preprocess_csv import get_tables, TableSnapshot
+from metrics import stage_timer, register_fast_path
+
+# Pre-classifier answers routine calls ("will pay tomorrow", wrong number, voicemail, switched off) from the most similar
+# past calls, before the summary and classifier LLM calls. Transcripts are turned into hashed word and character n-gram
+# TF-IDF vectors; the index is an inverted file (feature -> calls, weights) stored as .npy arrays and memory-mapped, so
+# the service starts without reading it into memory. The k nearest calls vote on the code, and the call skips the LLM
+# stages when the vote's confidence clears the code's threshold, calibrated offline for a target precision.
+#
+#   python preclassifier.py build archive.jsonl --labels dispositions.jsonl
+#   python preclassifier.py evaluate heldout.jsonl --labels heldout-dispositions.jsonl --llm-sample 200
+
+PRECLASSIFIER_ENABLED = os.getenv("PRECLASSIFIER_ENABLED", "true").lower() not in ("0", "false", "no")
+# Index directory; the build writes a new version into it and switches the CURRENT pointer
+PRECLASSIFIER_INDEX = Path(os.getenv("PRECLASSIFIER_INDEX", ".cache/preclassifier"))
+# Nearest calls that vote on the code
+PRECLASSIFIER_K = int(os.getenv("PRECLASSIFIER_K", "5"))
+# Per-code bypass thresholds as JSON {"WRONG_NUMBER": 0.8}; they override the thresholds calibrated by the build
+PRECLASSIFIER_THRESHOLDS: Dict[str, float] = json.loads(os.getenv("PRECLASSIFIER_THRESHOLDS") or "{}")
+# Seconds between checks for a rebuilt index
+PRECLASSIFIER_RELOAD_INTERVAL = float(os.getenv("PRECLASSIFIER_RELOAD_INTERVAL", "30"))
+
+# Codes never answered without the LLM: grievances need the grievance sub-classification
+NEVER_BYPASS = {"GRIEVANCE"}
+
+# Hashing: 64-bit polynomial hashes of character n-grams and CRC32 word hashes, mixed and cut to DIM_BITS bits
+DIM_BITS = 18
+CHAR_NGRAMS = (3, 4, 5)
+_PRIME = np.uint64(1099511628211)
+_SALTS = {name: np.uint64(zlib.crc32(name.encode()) * 0x9E3779B1) for name in ("c3", "c4", "c5", "w1", "w2")}
+_word = re.compile(r"\w+")
+
+# Mix is a function that scrambles 64-bit hashes (splitmix64 finalizer) so every output bit depends on every input bit
+def _mix(h: np.ndarray) -> np.ndarray:
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+# Char n-gram hashes is a function that hashes every n-byte window of the text at once
+def _char_ngram_hashes(data: np.ndarray, n: int) -> np.ndarray:
+    count = len(data) - n + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    h = np.zeros(count, dtype=np.uint64)
+    for k in range(n):
+        h = h * _PRIME + data[k:k + count]
+    return h
+
+# Transcript text is a function that renders a transcript the way the prompts see it, lowercased
+def transcript_text(transcript: List[Dict[str, Any]]) -> str:
+    return "".join(format_turn(speaker, content) for speaker, content in compact_turns(transcript)).lower()
+
+# Featurize is a function that returns a transcript's hashed feature ids and their counts
+def featurize(transcript: List[Dict[str, Any]], dim_bits: int = DIM_BITS) -> Tuple[np.ndarray, np.ndarray]:
+    text = transcript_text(transcript)
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+    words = np.array([zlib.crc32(w.encode("utf-8")) for w in _word.findall(text)], dtype=np.uint64)
+    parts = [_char_ngram_hashes(data, n) ^ _SALTS[f"c{n}"] for n in CHAR_NGRAMS]
+    parts.append(words ^ _SALTS["w1"])
+    if len(words) > 1:
+        parts.append((words[:-1] * _PRIME + words[1:]) ^ _SALTS["w2"])
+    ids = _mix(np.concatenate(parts)) >> np.uint64(64 - dim_bits)
+    ids, counts = np.unique(ids.astype(np.int64), return_counts=True)
+    return ids, counts.astype(np.float32)
+
+# TF-IDF is a function that weights feature counts (sublinear tf x idf), keeps the max_features heaviest and L2-normalizes
+def tfidf(ids: np.ndarray, counts: np.ndarray, idf: np.ndarray, max_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    weights = (1 + np.log(counts)) * idf[ids]
+    keep = weights > 0
+    ids, weights = ids[keep], weights[keep]
+    if len(ids) > max_features:
+        top = np.argpartition(weights, -max_features)[-max_features:]
+        ids, weights = ids[top], weights[top]
+    norm = np.linalg.norm(weights)
+    return ids, (weights / norm if norm else weights).astype(np.float32)
+
+# Table code is a function that maps a code in table or display form ("PTP ON SPECIFIC DATE", "GRIEVANCE(X)") onto the
+# disposition table's code, or None when the table does not have it
+def table_code(code: Optional[str], tables: TableSnapshot) -> Optional[str]:
+    if not code:
+        return None
+    if code.startswith("GRIEVANCE"):
+        return "GRIEVANCE"
+    by_display = {d['disposition_code'].replace("_", " "): d['disposition_code'] for d in tables.disposition_data}
+    return by_display.get(code.strip().replace("_", " "))
+
+# Preclassification is the pre-classifier's answer for one call
+class Preclassification(BaseModel):
+    code: str
+    confidence: float
+    similarity: float
+    votes: int
+    neighbours: int
+    connection_status: Optional[str] = None
+    index_version: str
+
+# Preclassifier index is one built, memory-mapped index version
+class PreclassifierIndex:
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.version = self.meta["version"]
+        self.codes: List[str] = self.meta["codes"]
+        self.thresholds: Dict[str, float] = self.meta.get("thresholds", {})
+        self.dim_bits = self.meta["dim_bits"]
+        self.max_features = self.meta["max_features"]
+        self.colptr = np.load(path / "colptr.npy", mmap_mode="r")
+        self.rows = np.load(path / "rows.npy", mmap_mode="r")
+        self.vals = np.load(path / "vals.npy", mmap_mode="r")
+        self.idf = np.load(path / "idf.npy", mmap_mode="r")
+        self.labels = np.load(path / "labels.npy", mmap_mode="r")
+
+    @property
+    def size(self) -> int:
+        return len(self.labels)
+
+    # Vector is a method that turns a transcript into a query vector
+    def vector(self, transcript: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        ids, counts = featurize(transcript, self.dim_bits)
+        return tfidf(ids, counts, self.idf, self.max_features)
+
+    # Scores is a method that returns the cosine similarity of a query vector to every indexed call, walking only the
+    # posting lists of the query's features (gathered in one vectorized step)
+    def scores(self, ids: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        starts = np.asarray(self.colptr[ids])
+        lengths = np.asarray(self.colptr[ids + 1]) - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(self.size, dtype=np.float32)
+        offsets = np.arange(total) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.bincount(
+            self.rows[offsets], weights=self.vals[offsets] * np.repeat(weights, lengths), minlength=self.size
+        ).astype(np.float32)
+
+    # Vote is a method that lets the k most similar calls vote, weighted by similarity. Confidence is the winning code's
+    # share of the vote times its closest call's similarity, so it is high only when near neighbours agree.
+    def vote(self, scores: np.ndarray, k: int = PRECLASSIFIER_K) -> Optional[Tuple[str, float, float, int, int]]:
+        k = min(k, self.size)
+        if k == 0:
+            return None
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[scores[top] > 0]
+        if len(top) == 0:
+            return None
+        weights: Dict[int, float] = defaultdict(float)
+        best: Dict[int, float] = defaultdict(float)
+        for doc in top:
+            label = int(self.labels[doc])
+            weights[label] += float(scores[doc])
+            best[label] = max(best[label], float(scores[doc]))
+        label = max(weights, key=weights.get)
+        share = weights[label] / sum(weights.values())
+        votes = sum(1 for doc in top if int(self.labels[doc]) == label)
+        return self.codes[label], share * best[label], best[label], votes, len(top)
+
+    # Threshold is a method that returns the confidence a code needs to skip the LLM (above 1 means never)
+    def threshold(self, code: str) -> float:
+        if code in NEVER_BYPASS:
+            return 2.0
+        return PRECLASSIFIER_THRESHOLDS.get(code, self.thresholds.get(code, 2.0))
+
+    def predict(self, transcript: List[Dict[str, Any]], k: int = PRECLASSIFIER_K) -> Optional[Preclassification]:
+        ids, weights = self.vector(transcript)
+        vote = self.vote(self.scores(ids, weights), k)
+        if vote is None:
+            return None
+        code, confidence, similarity, votes, neighbours = vote
+        return Preclassification(code=code, confidence=round(confidence, 4), similarity=round(similarity, 4),
+                                 votes=votes, neighbours=neighbours, index_version=self.version)
+
+# Preclassifier registry hands out the current index, loading it on first use and again when a build switches CURRENT.
+# Without a built index the pre-classifier stays out of the way.
+class PreclassifierRegistry:
+    def __init__(self, path: Path, reload_interval: float = PRECLASSIFIER_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._index: Optional[PreclassifierIndex] = None
+        self._mtime: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[PreclassifierIndex]:
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return self._index
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.reload_interval:
+                return self._index
+            self._checked_at = time.monotonic()
+            current = self.path / "CURRENT"
+            try:
+                mtime = current.stat().st_mtime_ns
+            except FileNotFoundError:
+                return self._index
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    index = PreclassifierIndex(self.path / current.read_text().strip())
+                except Exception as e:
+                    loguru.logger.error(f"Loading pre-classifier index failed, keeping the previous one: {e!r}")
+                else:
+                    self._index = index
+                    loguru.logger.info(f"Loaded pre-classifier index {index.version} ({index.size} calls)")
+            return self._index
+
+preclassifier_registry = PreclassifierRegistry(PRECLASSIFIER_INDEX)
+
+# Preclassifier path counts record how often the pre-classifier answered vs. passed the call to the LLM stages
+preclassifier_path_counts = Counter()
+register_fast_path("preclassifier", lambda: dict(preclassifier_path_counts))
+
+# Preclassify is a function that returns the pre-classifier's answer when it clears the code's threshold, else None
+# (the call then goes through the LLM stages)
+def preclassify(transcript: List[Dict[str, Any]], tables: TableSnapshot) -> Optional[Preclassification]:
+    if not PRECLASSIFIER_ENABLED:
+        return None
+    index = preclassifier_registry.get()
+    if index is None:
+        return None
+    with stage_timer("preclassify"):
+        prediction = index.predict(transcript)
+    # The code must still be in the current table; its table row gives the connection status
+    status = None
+    if prediction is not None:
+        status = next((s for s, codes in tables.status_codes.items() if prediction.code in codes), None)
+    if status is None or prediction.confidence < index.threshold(prediction.code):
+        preclassifier_path_counts["llm"] += 1
+        return None
+    preclassifier_path_counts["bypass"] += 1
+    prediction.connection_status = status
+    loguru.logger.info(f"Pre-classified as {prediction.code} ({prediction.confidence}, index {index.version})")
+    return prediction
+
+# Build, evaluation and the command line
+
+# Read labelled is a function that yields (id, transcript, code) rows from JSONL/CSV inputs. The code comes from the
+# labels map (id -> code, e.g. a bulk_disposition.py output) or from the row's own label field.
+def read_labelled(paths: List[str], labels: Dict[str, str], label_field: str, id_column: str,
+                  transcript_column: str) -> Iterator[Tuple[str, List[Dict[str, Any]], Optional[str]]]:
+    from bulk_disposition import read_csv
+    for path in paths:
+        if path.lower().endswith(".csv"):
+            for row_id, transcript, _ in read_csv(path, id_column, transcript_column):
+                yield row_id, transcript, labels.get(row_id)
+            continue
+        with open(path, encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                if not line.strip():
+                    continue
+                raw = json.loads(line)
+                row_id = str(raw.get("id", f"{path}:{index}"))
+                yield row_id, raw["transcript"], labels.get(row_id) or raw.get(label_field) or raw.get("Disposition_code")
+
+# Read labels is a function that reads id -> code from JSONL files of {"id", "Disposition_code"} rows
+def read_labels(paths: List[str]) -> Dict[str, str]:
+    labels = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    raw = json.loads(line)
+                    if raw.get("Disposition_code") and "id" in raw:
+                        labels[str(raw["id"])] = raw["Disposition_code"]
+    return labels
+
+# Calibrate is a function that picks, per code, the lowest confidence at which held-out predictions of that code were
+# right at least target_precision of the time, over at least min_support predictions. Codes that never get there
+# have no threshold (never bypassed).
+def calibrate(predictions: List[Tuple[str, float, str]], target_precision: float, min_support: int) -> Dict[str, float]:
+    by_code: Dict[str, List[Tuple[float, bool]]] = defaultdict(list)
+    for predicted, confidence, actual in predictions:
+        by_code[predicted].append((confidence, predicted == actual))
+    thresholds = {}
+    for code, rows in by_code.items():
+        if code in NEVER_BYPASS:
+            continue
+        rows.sort(key=lambda row: -row[0])
+        correct = np.cumsum([ok for _, ok in rows])
+        count = np.arange(1, len(rows) + 1)
+        precise = np.nonzero((correct / count >= target_precision) & (count >= min_support))[0]
+        if len(precise):
+            thresholds[code] = round(rows[precise[-1]][0], 4)
+    return thresholds
+
+# Build is a function that builds a new index version from labelled transcripts in two passes (document frequencies,
+# then vectors), calibrates the thresholds on a leave-one-out sample, and switches CURRENT to it
+def build(args) -> Path:
+    tables = get_tables()
+    labels = read_labels(args.labels or [])
+    rows = lambda: read_labelled(args.inputs, labels, args.label_field, args.id_column, args.transcript_column)
+
+    # Pass 1: document frequency of every feature
+    df = np.zeros(2 ** args.dim_bits, dtype=np.int64)
+    codes: List[str] = []
+    code_ids: Dict[str, int] = {}
+    doc_labels: List[int] = []
+    skipped = Counter()
+    for row_id, transcript, label in rows():
+        code = table_code(label, tables)
+        if code is None:
+            skipped["unlabelled" if not label else "unknown_code"] += 1
+            continue
+        ids, _ = featurize(transcript, args.dim_bits)
+        df[ids] += 1
+        if code not in code_ids:
+            code_ids[code] = len(codes)
+            codes.append(code)
+        doc_labels.append(code_ids[code])
+    n = len(doc_labels)
+    if n == 0:
+        raise SystemExit("No labelled transcripts with codes from the disposition table")
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    # Features in more than max_df of the calls ("lender said") carry no signal and would make every posting list long
+    idf[df > args.max_df * n] = 0
+
+    # Pass 2: vectors, collected feature-major into an inverted file
+    sample = set(random.Random(0).sample(range(n), min(n, args.calibration_sample)))
+    doc_ids, feature_ids, weights, held_out = [], [], [], {}
+    doc = 0
+    for row_id, transcript, label in rows():
+        if table_code(label, tables) is None:
+            continue
+        ids, counts = featurize(transcript, args.dim_bits)
+        ids, vector = tfidf(ids, counts, idf, args.max_features)
+        doc_ids.append(np.full(len(ids), doc, dtype=np.int32))
+        feature_ids.append(ids)
+        weights.append(vector)
+        if doc in sample:
+            held_out[doc] = (ids, vector)
+        doc += 1
+    doc_ids, feature_ids, weights = np.concatenate(doc_ids), np.concatenate(feature_ids), np.concatenate(weights)
+    order = np.argsort(feature_ids, kind="stable")
+    colptr = np.zeros(2 ** args.dim_bits + 1, dtype=np.int64)
+    colptr[1:] = np.cumsum(np.bincount(feature_ids, minlength=2 ** args.dim_bits))
+    labels_array = np.array(doc_labels, dtype=np.int32)
+
+    settings = json.dumps([args.k, args.target_precision, args.min_support, args.calibration_sample]).encode()
+    version = hashlib.sha256(labels_array.tobytes() + weights.tobytes() + settings).hexdigest()[:12]
+    root = Path(args.index)
+    # Written to a temporary directory and renamed into place: a running service may have the current version mapped
+    path = root / f".{version}.tmp"
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    np.save(path / "colptr.npy", colptr)
+    np.save(path / "rows.npy", doc_ids[order])
+    np.save(path / "vals.npy", weights[order])
+    np.save(path / "idf.npy", idf)
+    np.save(path / "labels.npy", labels_array)
+    meta = {"version": version, "built_at": time.time(), "codes": codes, "dim_bits": args.dim_bits,
+            "max_features": args.max_features, "size": n, "table_version": tables.version, "thresholds": {}}
+    (path / "meta.json").write_text(json.dumps(meta, indent=2))
+
+    # Leave-one-out on the sample: each sampled call is classified by the others
+    index = PreclassifierIndex(path)
+    predictions = []
+    for doc, (ids, vector) in held_out.items():
+        scores = index.scores(ids, vector)
+        scores[doc] = 0
+        vote = index.vote(scores, args.k)
+        if vote is not None:
+            predictions.append((vote[0], vote[1], codes[doc_labels[doc]]))
+    meta["thresholds"] = calibrate(predictions, args.target_precision, args.min_support)
+    meta["calibration"] = {"sample": len(held_out), "target_precision": args.target_precision, "min_support": args.min_support}
+    (path / "meta.json").write_text(json.dumps(meta, indent=2))
+    del index
+    final = root / version
+    if final.exists():
+        shutil.rmtree(path)
+    else:
+        os.replace(path, final)
+
+    # Switch CURRENT atomically; the service picks the new version up on its next check. The previous version is kept
+    # for services that have not switched yet, older ones are removed.
+    previous = (root / "CURRENT").read_text().strip() if (root / "CURRENT").exists() else None
+    pointer = root / "CURRENT.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, root / "CURRENT")
+    for old in root.iterdir():
+        if old.is_dir() and not old.name.startswith(".") and old.name not in (version, previous):
+            shutil.rmtree(old)
+
+    print(f"index {version}: {n} calls, {len(codes)} codes, {len(doc_ids)} postings -> {final}")
+    if skipped:
+        print(f"skipped: {dict(skipped)}")
+    print(f"calibrated on {len(predictions)} leave-one-out predictions (precision >= {args.target_precision}):")
+    for code in sorted(codes):
+        threshold = meta["thresholds"].get(code)
+        print(f"  {code:<36} {'never' if threshold is None else threshold}")
+    return final
+
+# LLM codes is a function that runs the LLM pipeline (summary and classifier, no cache) on transcripts, a few at a time
+def llm_codes(transcripts: List[List[Dict[str, Any]]], concurrency: int) -> List[Optional[str]]:
+    from Disposition_classifier_agnet import run_disposition
+    from result_cache import CACHE_BYPASS
+
+    async def run_all():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one(transcript):
+            async with slots:
+                try:
+                    return (await run_disposition(transcript, cache_mode=CACHE_BYPASS)).Disposition_code
+                except Exception as e:
+                    loguru.logger.warning(f"LLM path failed: {e!r}")
+                    return None
+        return await asyncio.gather(*[one(t) for t in transcripts])
+    return asyncio.run(run_all())
+
+# Evaluate is a function that reports the bypass rate on labelled held-out calls, how often bypassed answers agree with
+# the labels, and (with --llm-sample) with the LLM path run on a sample of the bypassed calls
+def evaluate(args) -> Dict[str, Any]:
+    tables = get_tables()
+    index = PreclassifierIndex(Path(args.index) / (Path(args.index) / "CURRENT").read_text().strip())
+    labels = read_labels(args.labels or [])
+    total = labelled = bypassed = labelled_bypassed = agree = top1 = 0
+    per_code: Dict[str, Counter] = defaultdict(Counter)
+    bypassed_rows = []
+    start = time.perf_counter()
+    for row_id, transcript, label in read_labelled(args.inputs, labels, args.label_field, args.id_column, args.transcript_column):
+        actual = table_code(label, tables)
+        prediction = index.predict(transcript, args.k)
+        total += 1
+        code = prediction.code if prediction else None
+        if actual is not None:
+            labelled += 1
+            top1 += code == actual
+            per_code[actual]["calls"] += 1
+        if prediction is not None and prediction.confidence >= index.threshold(code):
+            bypassed += 1
+            per_code[code]["bypassed"] += 1
+            if actual is not None:
+                labelled_bypassed += 1
+                agree += code == actual
+                per_code[code]["agree"] += code == actual
+            bypassed_rows.append((row_id, transcript, code))
+    elapsed = time.perf_counter() - start
+    report: Dict[str, Any] = {
+        "index_version": index.version,
+        "calls": total,
+        "bypassed": bypassed,
+        "bypass_rate": round(bypassed / total, 4) if total else 0.0,
+        "label_agreement_when_bypassed": round(agree / labelled_bypassed, 4) if labelled_bypassed else None,
+        "top1_label_agreement": round(top1 / labelled, 4) if labelled else None,
+        "ms_per_call": round(elapsed * 1000 / total, 3) if total else None,
+        "per_code": {code: dict(counts) for code, counts in sorted(per_code.items())},
+    }
+    if args.llm_sample and bypassed_rows:
+        sample = random.Random(0).sample(bypassed_rows, min(args.llm_sample, len(bypassed_rows)))
+        answers = llm_codes([transcript for _, transcript, _ in sample], args.llm_concurrency)
+        compared = [(code, table_code(answer, tables)) for (_, _, code), answer in zip(sample, answers) if answer is not None]
+        report["llm_sample"] = len(compared)
+        report["llm_agreement_when_bypassed"] = round(sum(a == b for a, b in compared) / len(compared), 4) if compared else None
+        report["llm_disagreements"] = dict(Counter(f"{a} -> {b}" for a, b in compared if a != b).most_common(20))
+
+    print(f"index {index.version}: {total} calls, bypassed {bypassed} ({report['bypass_rate']:.1%}), {report['ms_per_call']} ms/call")
+    if labelled_bypassed:
+        print(f"bypassed answers agree with labels: {agree}/{labelled_bypassed} ({report['label_agreement_when_bypassed']:.1%})")
+    if "llm_agreement_when_bypassed" in report and report["llm_sample"]:
+        print(f"bypassed answers agree with the LLM path: {report['llm_agreement_when_bypassed']:.1%} of {report['llm_sample']} sampled")
+    print(f"\n{'code':<36} {'calls':>6} {'bypassed':>9} {'agree':>6}")
+    for code, counts in report["per_code"].items():
+        print(f"{code:<36} {counts.get('calls', 0):>6} {counts.get('bypassed', 0):>9} {counts.get('agree', 0):>6}")
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and evaluate the nearest-neighbour pre-classifier index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("build", "build (or refresh) the index from labelled transcripts"),
+                            ("evaluate", "report bypass rate and agreement on labelled held-out transcripts")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("inputs", nargs="+", help="JSONL files of {id, transcript[, code]} rows, or CSV files with a JSON transcript column")
+        command.add_argument("--labels", nargs="*", help="JSONL files of {id, Disposition_code} rows, e.g. bulk_disposition.py output")
+        command.add_argument("--label-field", default="code", help="label field in JSONL input rows")
+        command.add_argument("--index", default=str(PRECLASSIFIER_INDEX))
+        command.add_argument("--k", type=int, default=PRECLASSIFIER_K, help="nearest calls that vote")
+        command.add_argument("--id-column", default="id", help="CSV column holding the row id")
+        command.add_argument("--transcript-column", default="transcript", help="CSV column holding the transcript JSON")
+    build_command, evaluate_command = commands.choices["build"], commands.choices["evaluate"]
+    build_command.add_argument("--dim-bits", type=int, default=DIM_BITS, help="hashed feature space is 2^dim-bits")
+    build_command.add_argument("--max-features", type=int, default=400, help="heaviest features kept per call")
+    build_command.add_argument("--max-df", type=float, default=0.5, help="features in more than this fraction of calls are dropped")
+    build_command.add_argument("--target-precision", type=float, default=0.97, help="precision a code's threshold must reach")
+    build_command.add_argument("--min-support", type=int, default=20, help="predictions a code's threshold must be based on")
+    build_command.add_argument("--calibration-sample", type=int, default=5000, help="calls classified leave-one-out for calibration")
+    evaluate_command.add_argument("--llm-sample", type=int, default=0, help="bypassed calls to also run through the LLM path")
+    evaluate_command.add_argument("--llm-concurrency", type=int, default=8)
+    evaluate_command.add_argument("--report", help="write the report as JSON")
+    args = parser.parse_args()
+    build(args) if args.command == "build" else evaluate(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,165 @@
-import pandas as pd
-
-# Disposition data is a list of dispositions
-disposition_data = []
-df = pd.read_csv("csv/General_disposition.csv")
-for row in df.itertuples(index=False, name=None):
-    data = {
-        "connected_status": row[0],
-        "disposition_code": row[1],
-        "disposition_label": row[2],
-        "disposition_description": row[3]
-    }
-    disposition_data.append(data)
-
-# Disposition data formatted is a formatted string of the disposition data
-disposition_data_formated = "\n".join([
-    f"{i+1}. CODE: {x['disposition_code']} | STATUS: {x['connected_status']} | LABEL: {x['disposition_label']} | DESC: {x['disposition_description']}"
-    for i, x in enumerate(disposition_data)
-])
-
-
-# Grievance data is a list of grievances
-disposition_data_grievance = []
-df_grievance_csv = pd.read_csv("csv/Grievance_Categories.csv")
-for row in df_grievance_csv.itertuples(index=False, name=None):
-    data = {
-        "parent_disposition_code": row[0],
-        "sub_category_code": row[1],
-        "sub_category_label": row[2],
-        "description_hindi": row[3]
-    }
-    disposition_data_grievance.append(data)
-
-# Grievance data formatted is a formatted string of the grievance data
-disposition_data_grievance_formated = "\n".join([
-    f"{i+1}. CODE: {x['sub_category_code']} | LABEL: {x['sub_category_label']} | DESC: {x['description_hindi']}"
-    for i, x in enumerate(disposition_data_grievance)
-])
+import os
+import io
+import csv
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import loguru
+
+# Table CSVs are the disposition and grievance tables the prompts are built from, resolved next to this file
+# so the service does not depend on the working directory
+BASE_DIR = Path(__file__).resolve().parent
+DISPOSITION_CSV = Path(os.getenv("DISPOSITION_CSV", BASE_DIR / "csv" / "General_disposition.csv"))
+GRIEVANCE_CSV = Path(os.getenv("GRIEVANCE_CSV", BASE_DIR / "csv" / "Grievance_Categories.csv"))
+# Seconds between mtime checks of the CSVs; edited tables are picked up without a restart
+TABLE_RELOAD_INTERVAL = float(os.getenv("TABLE_RELOAD_INTERVAL", "2"))
+
+# Connection statuses the disposition table is grouped by (same values as connection_status.CONNECTED / NOT_CONNECTED)
+CONNECTION_STATUSES = ("Connected", "Not Connected")
+
+# Read rows is a function that parses CSV bytes into rows, skipping the header and blank lines
+def _read_rows(data: bytes) -> List[List[str]]:
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+    rows = [row for row in rows[1:] if any(cell.strip() for cell in row)]
+    for line, row in enumerate(rows, start=2):
+        if len(row) < 4:
+            raise ValueError(f"row {line} has {len(row)} columns, expected at least 4")
+    return rows
+
+# Format dispositions is a function that formats disposition rows the way the prompts list them
+def format_dispositions(rows: List[Dict[str, Any]]) -> str:
+    return "\n".join([
+        f"{i+1}. CODE: {x['disposition_code']} | STATUS: {x['connected_status']} | LABEL: {x['disposition_label']} | DESC: {x['disposition_description']}"
+        for i, x in enumerate(rows)
+    ])
+
+# Format grievances is a function that formats grievance rows the way the prompts list them
+def format_grievances(rows: List[Dict[str, Any]]) -> str:
+    return "\n".join([
+        f"{i+1}. CODE: {x['sub_category_code']} | LABEL: {x['sub_category_label']} | DESC: {x['description_hindi']}"
+        for i, x in enumerate(rows)
+    ])
+
+# Table snapshot is one immutable version of both tables with everything the prompts need precomputed.
+# A request takes one snapshot and uses it throughout, so a reload never mixes two versions in one answer.
+class TableSnapshot:
+    def __init__(self, version: str, disposition_data: List[Dict[str, Any]], grievance_data: List[Dict[str, Any]]):
+        self.version = version
+        self.loaded_at = time.time()
+        self.disposition_data = disposition_data
+        self.disposition_data_formated = format_dispositions(disposition_data)
+        self.grievance_data = grievance_data
+        self.grievance_data_formated = format_grievances(grievance_data)
+        # Per connection status rows, formatted table and code set
+        self.status_data = {
+            status: [d for d in disposition_data if d['connected_status'] == status] for status in CONNECTION_STATUSES
+        }
+        self.status_tables = {status: format_dispositions(rows) for status, rows in self.status_data.items()}
+        self.status_codes = {status: frozenset(d['disposition_code'] for d in rows) for status, rows in self.status_data.items()}
+        self.grievance_codes = frozenset(g['sub_category_code'] for g in grievance_data)
+        self._prompts: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    # Prompt is a method that builds a prompt from this snapshot once and returns the stored copy afterwards
+    def prompt(self, name: str, build: Callable[["TableSnapshot"], str]) -> str:
+        prompt = self._prompts.get(name)
+        if prompt is None:
+            with self._lock:
+                prompt = self._prompts.get(name)
+                if prompt is None:
+                    prompt = self._prompts[name] = build(self)
+        return prompt
+
+# Load tables is a function that reads both CSVs into a new snapshot, versioned by a content hash of the files
+def load_tables(disposition_csv: Path, grievance_csv: Path) -> TableSnapshot:
+    disposition_bytes = disposition_csv.read_bytes()
+    grievance_bytes = grievance_csv.read_bytes()
+    disposition_data = [
+        {
+            "connected_status": row[0],
+            "disposition_code": row[1],
+            "disposition_label": row[2],
+            "disposition_description": row[3]
+        }
+        for row in _read_rows(disposition_bytes)
+    ]
+    grievance_data = [
+        {
+            "parent_disposition_code": row[0],
+            "sub_category_code": row[1],
+            "sub_category_label": row[2],
+            "description_hindi": row[3]
+        }
+        for row in _read_rows(grievance_bytes)
+    ]
+    version = hashlib.sha256(disposition_bytes + grievance_bytes).hexdigest()[:12]
+    return TableSnapshot(version, disposition_data, grievance_data)
+
+# Table registry hands out the current table snapshot, loading it on first use and again when a CSV's mtime changes.
+# The new snapshot is swapped in whole; a table that fails to load is logged and the previous version kept.
+class TableRegistry:
+    def __init__(self, disposition_csv: Path, grievance_csv: Path, reload_interval: float = TABLE_RELOAD_INTERVAL):
+        self.disposition_csv = disposition_csv
+        self.grievance_csv = grievance_csv
+        self.reload_interval = reload_interval
+        self._snapshot: Optional[TableSnapshot] = None
+        self._mtimes: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stat(self) -> Tuple[int, int]:
+        return (self.disposition_csv.stat().st_mtime_ns, self.grievance_csv.stat().st_mtime_ns)
+
+    def get(self) -> TableSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.reload_interval:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.reload_interval:
+                return self._snapshot
+            self._checked_at = time.monotonic()
+            mtimes = None
+            try:
+                mtimes = self._stat()
+                if self._snapshot is None or mtimes != self._mtimes:
+                    self._load(mtimes)
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                # Not retried until the files change again
+                self._mtimes = mtimes or self._mtimes
+                loguru.logger.error(f"Reloading disposition tables failed, keeping version {self._snapshot.version}: {e!r}")
+            return self._snapshot
+
+    def _load(self, mtimes: Tuple[int, int]) -> None:
+        snapshot = load_tables(self.disposition_csv, self.grievance_csv)
+        previous = self._snapshot.version if self._snapshot is not None else None
+        self._snapshot, self._mtimes = snapshot, mtimes
+        if snapshot.version != previous:
+            loguru.logger.info(
+                f"Loaded disposition tables version {snapshot.version} "
+                f"({len(snapshot.disposition_data)} dispositions, {len(snapshot.grievance_data)} grievance codes)"
+            )
+
+# Table registry for the configured CSVs; nothing is read until the first request
+table_registry = TableRegistry(DISPOSITION_CSV, GRIEVANCE_CSV)
+
+# Get tables is a function that returns the current table snapshot
+def get_tables() -> TableSnapshot:
+    return table_registry.get()
 
 # Get disposition data is a function that returns the disposition data
 def get_disposition_data():
-    return disposition_data_formated, disposition_data
+    tables = get_tables()
+    return tables.disposition_data_formated, tables.disposition_data
 
 # Get grievance data is a function that returns the grievance data
 def get_disposition_data_grievance():
-    return disposition_data_grievance_formated, disposition_data_grievance
\ No newline at end of file
+    tables = get_tables()
+    return tables.grievance_data_formated, tables.grievance_data
+
+# Get table version is a function that returns the version of the loaded disposition and grievance tables
+def get_table_version():
+    return get_tables().version
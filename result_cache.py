@@ -0,0 +1,143 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+load_dotenv()
+import loguru
+from T2T_agent import render_transcript
+from metrics import register_cache
+
+# Cache settings: CACHE_ENABLED turns the cache off entirely, the rest size the two tiers
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+CACHE_MEMORY_SIZE = int(os.getenv("CACHE_MEMORY_SIZE", "1024"))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", ".cache/disposition_cache.sqlite3")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_DB_ENTRIES = int(os.getenv("CACHE_MAX_DB_ENTRIES", "100000"))
+
+# Cache modes a request can ask for: use the cache, skip it entirely, or skip the read and overwrite the entry
+CACHE_USE = "use"
+CACHE_BYPASS = "bypass"
+CACHE_REFRESH = "refresh"
+CACHE_MODES = (CACHE_USE, CACHE_BYPASS, CACHE_REFRESH)
+
+# Transcript key is a function that hashes the normalized transcript together with whatever else the result depends on.
+# It records no preprocess stage: the result store calls it on its writer thread, outside any request.
+def transcript_key(transcript: List[Dict[str, Any]], *parts: Optional[str]) -> str:
+    normalized = " ".join(render_transcript(transcript).split())
+    digest = hashlib.sha256()
+    for part in (*parts, normalized):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+# Result cache is a two-tier cache: a bounded in-process LRU in front of a local SQLite table with TTL and size eviction
+class ResultCache:
+    def __init__(self, name: str, memory_size: int = CACHE_MEMORY_SIZE, db_path: Optional[str] = CACHE_DB_PATH,
+                 ttl_seconds: int = CACHE_TTL_SECONDS, max_db_entries: int = CACHE_MAX_DB_ENTRIES):
+        self.name = name
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self.stats = Counter()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        register_cache(self)
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+
+    # Get is a method that returns the cached value for a key, or None on a miss
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self.stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?", (self.name, key)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if now - created_at <= self.ttl_seconds:
+                        self._db.execute(
+                            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.name, key)
+                        )
+                        self._remember(key, value, created_at)
+                        self.stats["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.name, key))
+                    self.stats["expired"] += 1
+
+            self.stats["misses"] += 1
+            return None
+
+    # Set is a method that stores a value in both tiers and evicts the least recently used entries beyond the limits
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.name, key, value, now, now),
+                )
+                self.stats["disk_writes"] += 1
+                # Counting rows is a scan, so the size limit is enforced every few writes rather than on each one
+                if self.stats["disk_writes"] % 64:
+                    return
+                count = self._db.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.name,)).fetchone()[0]
+                if count > self.max_db_entries:
+                    evicted = self._db.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                        " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                        (self.name, self.name, count - self.max_db_entries),
+                    ).rowcount
+                    self.stats["disk_evictions"] += evicted
+
+    # Invalidate is a method that drops one key, or every entry of this cache when no key is given
+    def invalidate(self, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+                if self._db is not None:
+                    self._db.execute("DELETE FROM cache WHERE namespace = ?", (self.name,))
+            else:
+                self._memory.pop(key, None)
+                if self._db is not None:
+                    self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.name, key))
+        loguru.logger.info(f"Cache {self.name} invalidated: {key or 'all entries'}")
+
+    # Get stats is a method that returns hit/miss/eviction counters and the current memory tier size
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, "memory_entries": len(self._memory)}
+
+    # Remember is a method that puts an entry in the memory tier (caller holds the lock)
+    def _remember(self, key: str, value: str, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
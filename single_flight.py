@@ -0,0 +1,38 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+from metrics import COALESCED
+
+T = TypeVar("T")
+
+# Single flight lets concurrent calls with the same key share one execution: the first caller starts the work,
+# callers arriving while it runs wait on the same task. Unlike the result cache this helps before anything has finished
+# (dialer retries, double submits). Each caller awaits the task through asyncio.shield, so a caller that is cancelled
+# (client disconnect, timeout) stops waiting without cancelling the work the others are waiting on.
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = Counter()
+
+    async def run(self, key: str, work: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            COALESCED.labels(stage=self.name).inc()
+            return await asyncio.shield(task)
+        self.stats["executed"] += 1
+        task = asyncio.ensure_future(work())
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the outcome, so work whose callers all gave up does not log "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"executed": self.stats["executed"], "coalesced": self.stats["coalesced"], "in_flight": len(self._inflight)}
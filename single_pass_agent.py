@@ -0,0 +1,103 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+
+from llm_gateway import chat_model
+from langchain.agents import create_agent
+import loguru
+from preprocess_csv import get_tables, TableSnapshot
+from T2T_agent import preprocess_transcript
+from metrics import stage_timer, record_usage
+from typing import List, Dict, Any, Optional, Literal
+from pydantic import BaseModel
+
+# Single pass result is the combined structured output: connection status, summary, disposition and grievance in one call
+class SinglePassResult(BaseModel):
+    connection_status: Literal["Connected", "Not Connected"]
+    summary: str
+    Disposition_code: str
+    grievance_code: Optional[str] = None
+    confidence: float
+    explanation: str
+    key_points: List[str]
+
+# Single pass model is a model that summarizes and classifies the transcript in one round trip
+model = chat_model(model=os.getenv("OPENAI_MODEL"), temperature=0.3)
+
+# Single pass agent is a agent that returns the combined structured output
+agent = create_agent(
+    model=model,
+    tools=[],
+    response_format=SinglePassResult
+)
+
+# Single pass system prompt combines the summary, connection status, disposition and grievance instructions,
+# built once per table version
+def build_system_prompt(tables: TableSnapshot) -> str:
+    return f"""
+You are a Senior Call Center Disposition Classifier for Loan Collections.
+
+You receive a RAW CALL TRANSCRIPT between a loan collections agent (lender) and a customer (borrower).
+In ONE pass you must summarize it, decide the connection status, classify the disposition and, for grievances, the grievance subcategory.
+Use ONLY the codes in the tables below. Do NOT invent, infer, or generalize codes.
+
+## STEP 1 - SUMMARY
+Write a CLEAR, NEUTRAL English summary (4-6 sentences). Translate all languages. FACTS ONLY: who answered,
+main topics (EMI / payment / complaint / callback), the customer's key responses (promises / refusals / requests,
+amounts, dates) and how the call ended. No disposition codes or analysis in the summary.
+
+## STEP 2 - CONNECTION STATUS
+"Connected" if ANY human response beyond ringing/busy/unreachable; "Not Connected" if ringing, busy tone,
+switched off, no answer, network error.
+
+## STEP 3 - DISPOSITION (pick ONLY from the table matching the connection status, NEVER cross groups)
+CONNECTED DISPOSITIONS:
+{tables.status_tables['Connected']}
+
+NOT CONNECTED DISPOSITIONS:
+{tables.status_tables['Not Connected']}
+
+Match the EXACT scenario in the DESCRIPTION text; ignore generic conversation and look for SPECIFIC OUTCOMES.
+- ANSWERED_BY_FAMILY_MEMBER -> ONLY if "family/third person" + "customer unavailable" + "call later"
+- WRONG_NUMBER -> ONLY if "not customer" + "wrong number"
+
+## STEP 4 - GRIEVANCE SUBCATEGORY (ONLY when Disposition_code is GRIEVANCE, otherwise null)
+{tables.grievance_data_formated}
+
+## CONFIDENCE, EXPLANATION, KEY POINTS
+- confidence: 1.0 (or near) for clear, unambiguous evidence for a single code; 1.00-0.50 for partial match or overlap;
+  0.50-0.00 when you must guess. Use any decimal value (e.g. 0.88), not only round numbers.
+- explanation: why this code fits, citing transcript evidence; if confidence < 1.0 state what causes the remaining uncertainty.
+- key_points: the main facts from the transcript that inform the decision.
+
+## OUTPUT
+"connection_status": "Connected" or "Not Connected"
+"summary": "the summary from STEP 1"
+"Disposition_code": "EXACT_CODE_FROM_TABLE"
+"grievance_code": "EXACT_SUBCATEGORY_CODE" or null
+"confidence": confidence score of the disposition
+"explanation": explanation of the disposition
+"key_points": key points of the transcript
+"""
+
+# Single pass classifier is a function that classifies the transcript with one model call
+async def aget_single_pass(transcript: List[Dict[str, Any]], tables: Optional[TableSnapshot] = None) -> SinglePassResult:
+    tables = tables or get_tables()
+    transcript_string = preprocess_transcript(transcript)
+    with stage_timer("single_pass"):
+        result = await agent.ainvoke({"messages": [
+            {"role": "system", "content": tables.prompt("single_pass", build_system_prompt)},
+            {"role": "user", "content": f"""
+Here is the raw transcript. Summarize and classify it:
+
+TRANSCRIPT:
+{transcript_string}
+"""}]})
+    record_usage("single_pass", result['messages'])
+    response = result['structured_response']
+    if response.Disposition_code == 'GRIEVANCE' and response.connection_status == "Connected" and response.grievance_code:
+        response.Disposition_code = f"GRIEVANCE({response.grievance_code})"
+    response.Disposition_code = response.Disposition_code.replace("_", " ")
+    loguru.logger.info(f"Single Pass Result: {response.Disposition_code} ({response.connection_status})")
+    return response
@@ -0,0 +1,124 @@
+import json
+import time
+import asyncio
+from collections import deque
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, AsyncIterator
+import loguru
+from connection_status import adetect_connection_status
+from summary_agent import astream_summary
+from metrics import TIME_TO_FIRST_RESULT_SECONDS
+from preprocess_csv import get_tables
+from Disposition_classifier_agnet import speculate_for, classify_or_cancel, is_grievance, resolve_grievance, finalize_disposition, grievance_subcategory, store_result, MULTI_STAGE
+
+# Stream disposition router emits the pipeline stages as Server-Sent Events as soon as each one completes
+router = APIRouter()
+
+# Stream timings keep the most recent (time to first result, total) pairs in milliseconds
+stream_timings = deque(maxlen=1000)
+
+# SSE event is a function that formats one Server-Sent Event
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Stream disposition is a function that runs the pipeline and yields, in order:
+# connection_status, summary (one event per token), disposition, grievance (only for grievances), done
+async def stream_disposition(transcript: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    start = time.perf_counter()
+    tables = get_tables()
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    tokens: asyncio.Queue = asyncio.Queue()
+
+    # Summary tokens are produced alongside the connection check and buffered until connection_status is sent
+    async def produce_summary():
+        try:
+            async for token in astream_summary(transcript):
+                await tokens.put(token)
+        finally:
+            await tokens.put(None)
+
+    summary_task = asyncio.create_task(produce_summary())
+    speculation = None
+    try:
+        connection_status = await adetect_connection_status(transcript)
+        time_to_first_result_ms = elapsed_ms()
+        TIME_TO_FIRST_RESULT_SECONDS.observe(time_to_first_result_ms / 1000)
+        yield _sse_event("connection_status", {"connection_status": connection_status, "elapsed_ms": time_to_first_result_ms})
+
+        summary_parts = []
+        while (token := await tokens.get()) is not None:
+            summary_parts.append(token)
+            yield _sse_event("summary", {"token": token})
+        await summary_task  # re-raises a summary model failure
+        summary = "".join(summary_parts)
+        loguru.logger.info(f"Summary: {summary}")
+
+        speculation = speculate_for(summary, connection_status, tables)
+        result = await classify_or_cancel(summary, connection_status, tables, speculation)
+        grievance = is_grievance(result, connection_status)
+        if not grievance:
+            if speculation is not None:
+                speculation.discard()
+            result = finalize_disposition(result)
+        yield _sse_event("disposition", {**result.model_dump(), "elapsed_ms": elapsed_ms()})
+
+        if grievance:
+            result = await resolve_grievance(result, summary, tables, speculation)
+            yield _sse_event("grievance", {"Disposition_code": result.Disposition_code, "elapsed_ms": elapsed_ms()})
+        await store_result(transcript, result, MULTI_STAGE, tables, connection_status, grievance_subcategory(result) if grievance else None)
+
+        total_ms = elapsed_ms()
+        stream_timings.append((time_to_first_result_ms, total_ms))
+        loguru.logger.info(f"Stream disposition: first result {time_to_first_result_ms}ms, total {total_ms}ms")
+        yield _sse_event("done", {**result.model_dump(), "time_to_first_result_ms": time_to_first_result_ms, "total_ms": total_ms})
+    except Exception as e:
+        loguru.logger.exception("Stream disposition failed")
+        yield _sse_event("error", {"detail": str(e)})
+    finally:
+        summary_task.cancel()
+        # A client that disconnects before the grievance event leaves nobody to use the speculative call
+        if speculation is not None:
+            speculation.cancel()
+
+# Stream response is a function that wraps the event generator in an unbuffered SSE response
+def _stream_response(transcript: List[Dict[str, Any]]) -> StreamingResponse:
+    return StreamingResponse(
+        stream_disposition(transcript),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Percentile is a function that returns the p-th percentile of a sorted list
+def _percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+# Stream stats endpoint reports time to first result separately from total latency over recent streams
+@router.get("/disposition/stream/stats")
+async def get_stream_stats() -> Dict[str, Any]:
+    first = sorted(t[0] for t in stream_timings)
+    total = sorted(t[1] for t in stream_timings)
+    return {
+        "count": len(stream_timings),
+        "time_to_first_result_ms": {"p50": _percentile(first, 0.5), "p95": _percentile(first, 0.95)},
+        "total_ms": {"p50": _percentile(total, 0.5), "p95": _percentile(total, 0.95)},
+    }
+
+# Stream disposition endpoint (POST) takes the transcript as the JSON body, like /disposition
+@router.post("/disposition/stream")
+async def post_disposition_stream(transcript: List[Dict[str, Any]]) -> StreamingResponse:
+    return _stream_response(transcript)
+
+# Stream disposition endpoint (GET) takes the transcript as a JSON query parameter, for EventSource clients
+@router.get("/disposition/stream")
+async def get_disposition_stream(transcript: str) -> StreamingResponse:
+    try:
+        parsed = json.loads(transcript)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid transcript JSON: {e}")
+    if not isinstance(parsed, list):
+        raise HTTPException(status_code=400, detail="Transcript must be a list of messages")
+    return _stream_response(parsed)
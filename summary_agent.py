@@ -1,17 +1,28 @@
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-from langchain_openai import ChatOpenAI
+from llm_gateway import chat_model
 from langchain.agents import create_agent
 from langchain.agents.middleware.types import AgentMiddleware, ModelRequest, ModelResponse, ModelCallResult
 import loguru
-from T2T_agent import preprocess_transcript
-from typing import List, Dict, Any
+from T2T_agent import preprocess_transcript, compact_turns, format_turn, count_tokens, chunk_transcript
+from metrics import stage_timer, record_usage, STAGE_SECONDS
+from result_cache import ResultCache, transcript_key, CACHE_ENABLED, CACHE_USE, CACHE_BYPASS
+from single_flight import SingleFlight
+from typing import List, Dict, Any, Optional
 
 # Summary agent is a agent that summarizes the transcript into a text to text format
-model = ChatOpenAI(model=os.getenv("OPENAI_MODEL"), temperature=0.2)
+model = chat_model(model=os.getenv("OPENAI_MODEL"), temperature=0.2, stream_usage=True)
+
+# Summary cache stores summaries by normalized transcript and summary model
+summary_cache = ResultCache("summary")
+
+# Summary flight shares one summary between concurrent calls for the same transcript
+summary_flight = SingleFlight("summary")
 
 # Summary agent is a agent that summarizes the transcript into a text to text format
 summary_agent = create_agent(
@@ -50,12 +61,156 @@ Output PLAIN TEXT SUMMARY ONLY. No bullets. No markdown.
 
 """
 
-# Summary agent is a agent that summarizes the transcript into a text to text format
-def get_summary(transcript: List[Dict[str, Any]]):
-    transcript_string = preprocess_transcript(transcript)
-    result = summary_agent.invoke({"messages": [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": transcript_string}]})
-    res = result['messages'][-1].content
+# Transcripts above the token budget are summarized in chunks (map) whose partial summaries are then combined (reduce)
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "6000"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+# Chunk summaries in flight per transcript; chunks are only produced once a slot is free, so memory stays bounded by chunk size
+SUMMARY_CHUNK_CONCURRENCY = int(os.getenv("SUMMARY_CHUNK_CONCURRENCY", "4"))
+
+# Chunk prompt summarizes one part of a long call
+chunk_prompt = system_prompt + """
+This transcript is PART {part} of a longer call. Summarize ONLY this part (3-5 sentences), keeping every amount,
+date, promise, refusal and complaint. Do NOT guess how the call started or ended outside this part.
+"""
+
+# Reduce prompt combines the partial summaries of a long call into the final summary
+reduce_prompt = system_prompt + """
+The input is a sequence of PARTIAL SUMMARIES of consecutive parts of ONE call, in order.
+Combine them into ONE summary of the whole call following the rules above. Keep the key numbers, dates and
+customer responses; the last part decides how the call ended.
+"""
+
+# Rolling prompt folds the newest turns of a call that is still in progress into the summary so far
+rolling_prompt = system_prompt + """
+The call is STILL IN PROGRESS. The input is the SUMMARY SO FAR followed by the NEW TURNS since that summary.
+Return ONE updated summary of the whole call so far: keep every amount, date, promise, refusal and complaint from
+the summary so far and add what the new turns say. Do NOT describe how the call ended.
+"""
+
+# Summary messages is a function that builds the summary agent input from a system prompt and transcript text
+def _summary_messages(prompt: str, text: str):
+    return {"messages": [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": text}]}
+
+# Over budget is a function that counts compacted transcript tokens, stopping as soon as the budget is exceeded
+def _over_budget(transcript: List[Dict[str, Any]]) -> bool:
+    tokens = 0
+    for speaker, content in compact_turns(transcript):
+        tokens += count_tokens(format_turn(speaker, content))
+        if tokens > SUMMARY_TOKEN_BUDGET:
+            return True
+    return False
+
+# Reduce groups is a function that packs partial summaries into groups of at most SUMMARY_CHUNK_TOKENS tokens
+def _reduce_groups(partials: List[str]) -> List[str]:
+    groups, group, group_tokens = [], [], 0
+    for i, partial in enumerate(partials):
+        text = f"PART {i + 1}: {partial}\n"
+        tokens = count_tokens(text)
+        if group and group_tokens + tokens > SUMMARY_CHUNK_TOKENS:
+            groups.append("".join(group))
+            group, group_tokens = [], 0
+        group.append(text)
+        group_tokens += tokens
+    if group:
+        groups.append("".join(group))
+    return groups
+
+# Async summarize text is a function that runs the summary agent once and records its usage
+async def _asummarize_text(prompt: str, text: str) -> str:
+    result = await summary_agent.ainvoke(_summary_messages(prompt, text))
+    record_usage("summary", result['messages'])
+    return result['messages'][-1].content
+
+# Async map summaries is a function that summarizes a long transcript chunk by chunk, then reduces the partial summaries
+# in groups until they fit in one final reduce call; at most SUMMARY_CHUNK_CONCURRENCY chunks are in flight
+async def _amap_summaries(transcript: List[Dict[str, Any]]) -> List[str]:
+    slots = asyncio.Semaphore(SUMMARY_CHUNK_CONCURRENCY)
+
+    async def summarize(prompt: str, text: str) -> str:
+        try:
+            return await _asummarize_text(prompt, text)
+        finally:
+            slots.release()
+
+    tasks = []
+    try:
+        # The next chunk is only built once a slot is free, so at most SUMMARY_CHUNK_CONCURRENCY chunks are held at a time
+        for i, chunk in enumerate(chunk_transcript(transcript, SUMMARY_CHUNK_TOKENS)):
+            await slots.acquire()
+            tasks.append(asyncio.create_task(summarize(chunk_prompt.format(part=i + 1), chunk)))
+        partials = list(await asyncio.gather(*tasks))
+        while len(partials) > 1 and count_tokens("".join(_reduce_groups(partials))) > SUMMARY_TOKEN_BUDGET:
+            tasks = []
+            for group in _reduce_groups(partials):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(summarize(reduce_prompt, group)))
+            partials = list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    loguru.logger.info(f"Summarized long transcript in chunks: {len(partials)} partial summaries to reduce")
+    return partials
+
+# Summary cache lookup is a function that returns the cache key (None when caching is off) and any cached summary
+def _summary_cache_lookup(transcript: List[Dict[str, Any]], cache_mode: str):
+    if not CACHE_ENABLED or cache_mode == CACHE_BYPASS:
+        return None, None
+    key = transcript_key(transcript, "summary", os.getenv("OPENAI_MODEL"))
+    return key, summary_cache.get(key) if cache_mode == CACHE_USE else None
+
+# Async summary agent summarizes the transcript; concurrent calls for the same transcript share one run
+async def aget_summary(transcript: List[Dict[str, Any]], cache_mode: str = CACHE_USE):
+    key, cached = _summary_cache_lookup(transcript, cache_mode)
+    if cached is not None:
+        return cached
+    flight_key = key or transcript_key(transcript, "summary", os.getenv("OPENAI_MODEL"))
+    return await summary_flight.run(flight_key, lambda: _asummarize(transcript, key))
+
+# Async summarize is a function that runs the (possibly map-reduce) summary and stores it in the cache
+async def _asummarize(transcript: List[Dict[str, Any]], key: Optional[str]):
+    with stage_timer("summary"):
+        if _over_budget(transcript):
+            res = await _asummarize_text(reduce_prompt, "".join(_reduce_groups(await _amap_summaries(transcript))))
+        else:
+            res = await _asummarize_text(system_prompt, preprocess_transcript(transcript))
+    if key is not None:
+        summary_cache.set(key, res)
     return res
 
+# Streaming summary agent yields the summary token by token straight from the summary model.
+# Long transcripts are mapped to partial summaries first; only the final reduce step is streamed.
+async def astream_summary(transcript: List[Dict[str, Any]], cache_mode: str = CACHE_USE):
+    key, cached = _summary_cache_lookup(transcript, cache_mode)
+    if cached is not None:
+        yield cached
+        return
+    tokens = []
+    usage = None
+    start = time.perf_counter()
+    if _over_budget(transcript):
+        messages = _summary_messages(reduce_prompt, "".join(_reduce_groups(await _amap_summaries(transcript))))
+    else:
+        messages = _summary_messages(system_prompt, preprocess_transcript(transcript))
+    async for chunk in model.astream(messages["messages"]):
+        if chunk.usage_metadata:
+            usage = chunk
+        if chunk.content:
+            tokens.append(chunk.content)
+            yield chunk.content
+    # Timed by hand: a stage_timer around the loop would also count the time the consumer spends between tokens
+    STAGE_SECONDS.labels(stage="summary").observe(time.perf_counter() - start)
+    if usage is not None:
+        record_usage("summary", usage)
+    if key is not None:
+        summary_cache.set(key, "".join(tokens))
+
+# Async update summary is a function that folds new transcript text (formatted turns) into a rolling summary,
+# so a live call is summarized from its new turns only rather than the whole history
+async def aupdate_summary(previous: str, new_text: str) -> str:
+    with stage_timer("summary"):
+        if not previous:
+            return await _asummarize_text(system_prompt, new_text)
+        return await _asummarize_text(rolling_prompt, f"SUMMARY SO FAR:\n{previous}\n\nNEW TURNS:\n{new_text}")
@@ -0,0 +1,13 @@
+import os
+import sys
+from pathlib import Path
+
+# The modules read their settings at import time: no API key is needed (every model is faked), and the caches,
+# the result store and the pre-classifier are off so each test run goes through the pipeline
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("OPENAI_MODEL", "gpt-4o-mini")
+os.environ["CACHE_ENABLED"] = "false"
+os.environ["RESULT_STORE_ENABLED"] = "false"
+os.environ["PRECLASSIFIER_ENABLED"] = "false"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,73 @@
+import time
+import asyncio
+import httpx
+import pytest
+from langchain_core.messages import AIMessage
+import main
+import summary_agent
+import connection_status
+import Disposition_classifier_agnet as classifier_module
+from Disposition_classifier_agnet import DispositionResult
+
+# Seconds each fake model call takes; a call is connection status || summary, then classify
+MODEL_LATENCY = 0.3
+CONCURRENT_REQUESTS = 20
+
+# Fake chat model stands in for the status model: sleeps like a network call and answers CONNECTED
+class FakeChatModel:
+    async def ainvoke(self, messages):
+        await asyncio.sleep(MODEL_LATENCY)
+        return AIMessage(content="CONNECTED")
+
+# Fake summary agent sleeps like a network call and returns a fixed summary
+class FakeSummaryAgent:
+    async def ainvoke(self, messages):
+        await asyncio.sleep(MODEL_LATENCY)
+        return {"messages": [AIMessage(content="Customer confirmed the EMI payment for tomorrow.")]}
+
+# Fake classifier stands in for the model cascade
+class FakeClassifier:
+    async def ainvoke(self, messages, allowed_codes=None):
+        await asyncio.sleep(MODEL_LATENCY)
+        response = DispositionResult(
+            Disposition_code="PTP_ON_SPECIFIC_DATE", confidence=0.95, explanation="fake", key_points=[],
+        )
+        return {"structured_response": response, "model_tier": "fake", "messages": []}
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    monkeypatch.setattr(connection_status, "status_model", FakeChatModel())
+    monkeypatch.setattr(summary_agent, "summary_agent", FakeSummaryAgent())
+    monkeypatch.setattr(classifier_module, "classifier", FakeClassifier())
+
+# Transcript is a function that builds a distinct connected call, so concurrent requests are not coalesced
+def transcript(i: int):
+    return [
+        {"role": "assistant", "content": "Hello, this is Priya calling from Capri Global regarding your loan EMI."},
+        {"role": "user", "content": f"Haan ji, main kal {i + 1} baje tak paise daal dunga."},
+    ]
+
+async def _post_all(client: httpx.AsyncClient, count: int):
+    return await asyncio.gather(*(client.post("/disposition", json=transcript(i)) for i in range(count)))
+
+async def _timed_run():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        start = time.perf_counter()
+        [single] = await _post_all(client, 1)
+        one_call = time.perf_counter() - start
+
+        start = time.perf_counter()
+        responses = await _post_all(client, CONCURRENT_REQUESTS)
+        concurrent = time.perf_counter() - start
+    return single, one_call, responses, concurrent
+
+# Concurrent requests run their model calls side by side, so N of them finish in about the time of one
+def test_concurrent_requests_take_about_one_call(fake_models):
+    single, one_call, responses, concurrent = asyncio.run(_timed_run())
+
+    assert single.status_code == 200
+    assert single.json()["Disposition_code"] == "PTP ON SPECIFIC DATE"
+    assert all(response.status_code == 200 for response in responses)
+    assert one_call >= 2 * MODEL_LATENCY
+    # Serial handling would take CONCURRENT_REQUESTS x one_call
+    assert concurrent < one_call + 2 * MODEL_LATENCY
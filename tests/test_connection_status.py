@@ -0,0 +1,24 @@
+import json
+from pathlib import Path
+import pytest
+from connection_status import rule_status, NOT_CONNECTED
+
+FIXTURES = Path(__file__).resolve().parent.parent / "fixtures" / "connection_status_labelled.jsonl"
+ROWS = [json.loads(line) for line in FIXTURES.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+# The rule path may leave a call to the LLM, but a decision it makes must match the label
+@pytest.mark.parametrize("row", ROWS, ids=[row["id"] for row in ROWS])
+def test_rule_decision_matches_label(row):
+    status, scores = rule_status(row["transcript"])
+    assert status in (None, row["label"]), scores
+
+# Short human replies, including "busy", are never decided Not Connected by the rules
+@pytest.mark.parametrize("reply", ["Call later", "Main busy hoon", "I am busy right now, call me later", "Speaking",
+                                   "Okay bye", "Sorry, who?", "Phone band hai abhi"])
+def test_human_reply_is_not_ruled_not_connected(reply):
+    transcript = [
+        {"role": "assistant", "content": "Hello, this is Priya calling from Capri Global regarding your loan EMI."},
+        {"role": "user", "content": reply},
+    ]
+    status, _ = rule_status(transcript)
+    assert status != NOT_CONNECTED
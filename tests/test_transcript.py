@@ -0,0 +1,25 @@
+from T2T_agent import compact_turn, preprocess_transcript
+
+# Boilerplate is removed from lender turns, but a borrower's own words are kept
+def test_boilerplate_only_removed_from_lender_turns():
+    assert compact_turn("Please wait, I am checking my account", "borrower") == "Please wait, I am checking my account"
+    assert compact_turn("This call is being recorded. Your EMI is due on the 5th.", "lender") == "Your EMI is due on the 5th."
+
+# A borrower turn that matches a boilerplate pattern as a whole is still borrower speech
+def test_borrower_turn_of_boilerplate_words_is_kept():
+    transcript = [
+        {"role": "assistant", "content": "Hello, am I speaking with Mr. Verma? This call is being recorded."},
+        {"role": "user", "content": "Please hold."},
+        {"role": "user", "content": "Umm haan, haan, bol raha hoon."},
+    ]
+    assert preprocess_transcript(transcript) == (
+        "lender said: Hello, am I speaking with Mr. Verma?, borrower said: Please hold., "
+        "borrower said: haan, bol raha hoon., "
+    )
+
+# Only filler words are collapsed; repeated amounts, phone numbers and ordinary words are kept as spoken
+def test_repeated_fillers_collapse_but_numbers_and_words_do_not():
+    assert compact_turn("Hello? hello? Hello? haan haan, bol raha hoon", "borrower") == "Hello? haan, bol raha hoon"
+    assert compact_turn("EMI is 500 500 rupees", "borrower") == "EMI is 500 500 rupees"
+    assert compact_turn("call me on 98 98 98 98 98", "borrower") == "call me on 98 98 98 98 98"
+    assert compact_turn("I had had enough", "borrower") == "I had had enough"